@@ -1,13 +1,16 @@
+import sys
+import csv
 from nltk.tree import Tree
 import preprocess
+from featstore import FeatureStore,FEATURE_NAMES
 
 def save_trees():
 	print('saving trees')
-	trees = preprocess.get_trees('coref.feat') #longorshort
+	trees = preprocess.get_trees('coref.store') #longorshort
 	counter = 0
 	with open('trees.txt','w',encoding='utf8') as tree_file: #longorshort
 		for tree in trees:
-			tree_file.write(str(tree)+'|SPLIT|'+str(trees[tree])+'\n')
+			tree_file.write(str(tree)+'|SPLIT|'+trees[tree].tree.pformat(margin=sys.maxsize)+'\n')
 			counter += 1
 
 def open_trees(load):
@@ -229,7 +232,7 @@ def link_chains(all_proposals):
 	return chains
 
 def chains_to_feat(chains):
-	feats = open('coref.feat',encoding='utf8') #longorshort
+	feats = FeatureStore('coref.store') #longorshort
 
 	labels = {}
 	for chain in chains:
@@ -254,28 +257,19 @@ def chains_to_feat(chains):
 		for label in labels:
 			log.write(label + ' ' + labels[label]+'\n')
 
-	with open('output.txt','w',encoding='utf8') as out:
-		for line in feats:
-			outputline = line
-			if line != 'doc_id,part_num,sent_num,word_num,word,pos,parse_bit,pred_lemma,pred_frame_id,sense,speaker,ne,corefs':
-				doc = line.split(',')[0]
-				part = line.split(',')[1]
-				sent = line.split(',')[2]
-				word = line.split(',')[3]
-				linename = str((doc,part,sent,word))
-				
-
-				if linename in labels:
-					row = line.split(',')
-					row[-1] = labels[linename]
-					outputline = ','.join(row) + '\n'
-				else:
-					row = line.split(',')
-					row[-1] = '-'
-					outputline = ','.join(row) + '\n'
-
-			out.write(outputline)
-	feats.close()
+	with open('output.txt','w',encoding='utf8',newline='') as out:
+		writer = csv.writer(out)
+		writer.writerow(FEATURE_NAMES)
+		for row in feats.rows():
+			row = [str(value) for value in row]
+			linename = str(tuple(row[:4]))
+
+			if linename in labels:
+				row[-1] = labels[linename]
+			else:
+				row[-1] = '-'
+
+			writer.writerow(row)
 
 
 
@@ -0,0 +1,188 @@
+"""Persistent cache of NP attributes (gender, plurality) for npfeats and the sieve, in place of genders.txt and plurality.txt.
+
+Each cache is an append-only file of records, one per line:
+    <crc32 of the rest, 8 hex digits>\t<np>\t<value>\n
+New values are appended a batch at a time while a run goes on (every FLUSH_EVERY new values, and on close), so a crash loses
+at most one batch. A record that was only partly written fails its checksum and is skipped when the file is read back, and
+if the same NP was recorded more than once, the last record wins.
+
+Several processes (e.g. the workers of main.py --workers) can use the same cache file at once. Appends are made under an
+exclusive lock on the file, and when an NP isn't found in memory, the records other processes appended since are read
+(through a memory map of the file) before giving up. Only the maxsize most recently used NPs are kept; when the file holds
+more than twice that many records, it is rewritten with just those.
+
+NPs are normalized (see normalize_np) before they're stored or looked up, so 'The_Senate' and 'the senate' are the same key.
+"""
+import fcntl
+import mmap
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+
+GENDER_CACHE = '../genders.cache'
+PLURALITY_CACHE = '../plurality.cache'
+ATTR_CACHE_SIZE = 100000
+FLUSH_EVERY = 100
+
+def normalize_np(np):
+    """The form NPs are cached under: lowercased, with underscores as spaces and runs of whitespace collapsed to one space"""
+    return ' '.join(np.replace('_',' ').lower().split())
+
+def encode_record(key,value):
+    body = (key + '\t' + value).encode('utf8')
+    return b'%08x\t' % zlib.crc32(body) + body + b'\n'
+
+def decode_records(data):
+    """Get the (np, value) of every intact record in data, which should end at the end of a line. Torn or corrupt lines are skipped."""
+    records = []
+    for line in data.split(b'\n')[:-1]:
+        crc,sep,body = line.partition(b'\t')
+        if sep and crc == b'%08x' % zlib.crc32(body):
+            key,sep,value = body.decode('utf8').partition('\t')
+            if sep:
+                records.append((key,value))
+    return records
+
+class AttributeCache(object):
+    """A dictionary-like cache from NPs to attribute values, kept in an append-only file (see the module docstring).
+    It can be used anywhere npfeats takes a log (log_g or log_p). Call flush() to write out new values early and close() when done."""
+
+    def __init__(self,path,maxsize=ATTR_CACHE_SIZE,flush_every=FLUSH_EVERY):
+        self.path = path
+        self.maxsize = maxsize
+        self.flush_every = flush_every
+        self.entries = OrderedDict()
+        self.pending = []
+        self.lock = threading.RLock()
+        self.fd = None
+        self.open_file()
+        with self.lock,self.locked(fcntl.LOCK_EX):
+            if self.records > 2*self.maxsize:
+                self.compact()
+
+    def open_file(self):
+        """(Re)open the cache file, reading everything in it from the start"""
+        if self.fd is not None:
+            os.close(self.fd)
+        self.fd = os.open(self.path,os.O_RDWR | os.O_CREAT | os.O_APPEND,0o644)
+        self.position = 0
+        self.records = 0
+
+    @contextmanager
+    def locked(self,mode):
+        """Hold a lock on the cache file, after catching up on the records other processes have written to it.
+        If another process has rewritten the file in the meantime, the new file is opened and read instead."""
+        while True:
+            fcntl.flock(self.fd,mode)
+            if os.fstat(self.fd).st_ino == os.stat(self.path).st_ino:
+                break
+            fcntl.flock(self.fd,fcntl.LOCK_UN)
+            self.open_file()
+        try:
+            self.read_new()
+            yield
+        finally:
+            fcntl.flock(self.fd,fcntl.LOCK_UN)
+
+    def read_new(self):
+        """Read the records appended to the file since it was last read"""
+        size = os.fstat(self.fd).st_size
+        if size <= self.position:
+            return
+        with mmap.mmap(self.fd,size,access=mmap.ACCESS_READ) as mm:
+            data = mm[self.position:size]
+
+        #A process may be partway through appending a line; it'll be read next time
+        end = data.rfind(b'\n') + 1
+        for key,value in decode_records(data[:end]):
+            self.remember(key,value)
+            self.records += 1
+        self.position += end
+
+    def remember(self,key,value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def lookup(self,key):
+        """Find a normalized NP, checking for records from other processes if it isn't in memory. Returns None if it isn't cached."""
+        with self.lock:
+            if key not in self.entries:
+                with self.locked(fcntl.LOCK_SH):
+                    pass
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def __contains__(self,np):
+        return self.lookup(normalize_np(np)) is not None
+
+    def __getitem__(self,np):
+        value = self.lookup(normalize_np(np))
+        if value is None:
+            raise KeyError(np)
+        return value
+
+    def get(self,np,default=None):
+        value = self.lookup(normalize_np(np))
+        return default if value is None else value
+
+    def __setitem__(self,np,value):
+        key = normalize_np(np)
+        with self.lock:
+            if self.entries.get(key) == value:
+                self.entries.move_to_end(key)
+                return
+            self.remember(key,value)
+            self.pending.append(encode_record(key,value))
+            if len(self.pending) >= self.flush_every:
+                self.flush()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def flush(self):
+        """Append the values set since the last flush to the file"""
+        with self.lock:
+            if self.pending == []:
+                return
+            with self.locked(fcntl.LOCK_EX):
+                size = os.fstat(self.fd).st_size
+                self.records += len(self.pending)
+
+                #If a crash left a torn line at the end, end it so our first record starts on a line of its own
+                if size > 0 and os.pread(self.fd,1,size-1) != b'\n':
+                    self.pending.insert(0,b'\n')
+                os.write(self.fd,b''.join(self.pending))
+                self.position = os.fstat(self.fd).st_size
+                self.pending = []
+                if self.records > 2*self.maxsize:
+                    self.compact()
+
+    def compact(self):
+        """Rewrite the file with just the cached values, replacing it atomically. Must be called holding the file lock."""
+        temp = self.path + '.' + str(os.getpid()) + '.tmp'
+        data = b''.join(encode_record(key,value) for key,value in self.entries.items())
+        with open(temp,'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp,self.path)
+
+        #Closing the old file releases its lock; anyone waiting on it will see it's been replaced and open the new one
+        self.open_file()
+        self.position = len(data)
+        self.records = len(self.entries)
+
+    def close(self):
+        """Write out anything not yet flushed and close the file"""
+        with self.lock:
+            if self.fd is None:
+                return
+            self.flush()
+            os.close(self.fd)
+            self.fd = None
@@ -0,0 +1,80 @@
+import numpy as np
+from featstore import MENTION_DTYPE
+
+class MentionClusters(object):
+    """The partition of a part's mentions into clusters, shared by all the sieve modules.
+    Mentions are (sent_num, start, end) tuples of word numbers. They're numbered in text order (by sentence, then by first word),
+    and the modules refer to them by those numbers. Mentions that start at the same word are ordered by their ranks, if given
+    (see sieve_modules.mention_ranks), or else by the order they were given in.
+
+    This is a disjoint-set forest with path compression, so finding a mention's cluster and merging two clusters are
+    both close to constant time. Each cluster also keeps its members as a linked list, so merging just appends one list
+    to the other, and the clusters only have to be turned into lists of mentions once, by groupings().
+
+    The root of a cluster is always the mention it started from. Since the modules only ever merge a cluster into one
+    that starts earlier in the text, the root is also the cluster's earliest mention, and clusters are ordered by their roots.
+
+    Attributes:
+      mentions - The mentions, indexed by id
+      count - The number of clusters, which goes down by one with every merge
+    """
+
+    def __init__(self,spans,ranks=None):
+        """Start with every mention in its own cluster
+        Input:
+          spans - The mentions, as an array of featstore.MENTION_DTYPE or (sent_num, start, end) tuples; duplicates are only counted once
+          ranks - A number for each of the spans, breaking ties between mentions that start at the same word (lowest first)
+        """
+        spans = np.asarray(spans,dtype=MENTION_DTYPE)
+        ranks = np.arange(len(spans)) if ranks is None else np.asarray(ranks)
+
+        #Keep the first of any duplicates, in the order they were given
+        first = np.sort(np.unique(spans,return_index=True)[1])
+        spans = spans[first]
+        ranks = ranks[first]
+
+        #lexsort sorts by the last key first
+        self.mentions = spans[np.lexsort((ranks,spans['start'],spans['sent']))].tolist()
+        self.parent = list(range(len(self.mentions)))
+        self.next = [None]*len(self.mentions)
+        self.tail = list(range(len(self.mentions)))
+        self.count = len(self.mentions)
+
+    def __len__(self):
+        return len(self.mentions)
+
+    def find(self,i):
+        """Find the root of mention i's cluster, pointing every mention on the way straight at it"""
+        root = i
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[i] != root:
+            self.parent[i],i = root,self.parent[i]
+        return root
+
+    def union(self,a,b):
+        """Merge the cluster of mention b into the cluster of mention a. The root of a's cluster stays the root,
+        and b's cluster's members go after a's. Returns the root."""
+        rootA = self.find(a)
+        rootB = self.find(b)
+        if rootA != rootB:
+            self.parent[rootB] = rootA
+            self.next[self.tail[rootA]] = rootB
+            self.tail[rootA] = self.tail[rootB]
+            self.count -= 1
+        return rootA
+
+    def roots(self):
+        """Get the root of every cluster, in order"""
+        return [i for i in range(len(self.mentions)) if self.parent[i] == i]
+
+    def members(self,root):
+        """Iterate over the members of the cluster with this root, in the order they joined it"""
+        i = root
+        while i is not None:
+            yield i
+            i = self.next[i]
+
+    def groupings(self):
+        """Get the clusters as a list of lists of (sent_num, start, end) tuples"""
+        return [[self.mentions[i] for i in self.members(root)] for root in self.roots()]
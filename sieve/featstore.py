@@ -0,0 +1,206 @@
+"""Columnar on-disk store for the featurized CONLL words and their coreference chains.
+
+A store is a directory of .npy files:
+    <column>.npy                    - part_num, sent_num and word_num, as integers
+    <column>.codes.npy/.vocab.npy   - every other column, dictionary-encoded: one integer code per word, plus the list of distinct strings
+    doc_offsets.npy                 - the first row of each document (in doc_id vocab order), followed by the total number of rows
+    part_docs.npy, part_nums.npy    - the document and part number of each (doc_id, part_num) pair, in the order they appear
+    part_offsets.npy                - the first row of each part, followed by the total number of rows
+    chain_*.npy                     - one row per mention, chain by chain within each part: its sentence, and its first and last words
+    chain_offsets.npy               - the first chain_* row of each part, followed by the total number of mentions
+
+Documents and parts are stored contiguously, so one can be loaded by slicing the columns with its offsets.
+The arrays are memory-mapped when the store is opened, so only the slices that are actually used get read from disk.
+"""
+import os
+from array import array
+import numpy as np
+
+FEATURE_NAMES = ("doc_id", "part_num","sent_num",
+            "word_num", "word", "pos",
+            "parse_bit", "pred_lemma", "pred_frame_id",
+            "sense","speaker","ne","corefs"
+            )
+INT_COLUMNS = ("part_num","sent_num","word_num")
+CHAIN_COLUMNS = ("chain_sent","chain_start","chain_end")
+
+#How mentions are handed to the sieve: sentence number, and the word numbers of the first and last words
+MENTION_DTYPE = np.dtype([('sent',np.int32),('start',np.int32),('end',np.int32)])
+
+class FeatureWriter(object):
+    """Builds a feature store one file at a time. Call write() for each file's rows and chains, then close() to save it."""
+
+    def __init__(self,path):
+        self.path = path
+        self.columns = {name:array('i') for name in FEATURE_NAMES}
+        self.vocabs = {name:dict() for name in FEATURE_NAMES if name not in INT_COLUMNS}
+        self.chains = {name:array('i') for name in CHAIN_COLUMNS}
+        self.docOffsets = []
+        self.partDocs = []
+        self.partNums = []
+        self.partOffsets = []
+        self.chainOffsets = []
+
+    def encode(self,vocab,value):
+        """Get the code for a string, adding it to the vocab if it's new"""
+        try:
+            return vocab[value]
+        except KeyError:
+            vocab[value] = len(vocab)
+            return vocab[value]
+
+    def write(self,rows,chains):
+        """Add a file's words and coreference chains to the store
+        Inputs:
+          rows - The file's feature tuples, in FEATURE_NAMES order
+          chains - The file's coreference chain dictionary (see preprocess.build_coref_chains)
+        """
+        for row in rows:
+            for name,value in zip(FEATURE_NAMES,row):
+                if name in INT_COLUMNS:
+                    self.columns[name].append(int(value))
+                else:
+                    self.columns[name].append(self.encode(self.vocabs[name],value))
+
+            #A new document starts here; they have to be contiguous so they can be sliced out later
+            doc = self.columns['doc_id'][-1]
+            if doc == len(self.docOffsets):
+                self.docOffsets.append(len(self.columns['doc_id'])-1)
+            elif doc != self.columns['doc_id'][-2]:
+                raise ValueError('Document ' + row[0] + ' is split up in the CONLL files')
+
+            #Likewise for a new part
+            part = self.columns['part_num'][-1]
+            if len(self.partDocs) == 0 or (doc,part) != (self.partDocs[-1],self.partNums[-1]):
+                self.partDocs.append(doc)
+                self.partNums.append(part)
+                self.partOffsets.append(len(self.columns['part_num'])-1)
+
+        #build_coref_chains lists every part, in the order they appear, so each part's mentions start where the last one's end
+        for partDict in chains.values():
+            for chainDict in partDict.values():
+                self.chainOffsets.append(len(self.chains['chain_sent']))
+                for chain in chainDict.values():
+                    for sent_num,start,end in chain:
+                        self.chains['chain_sent'].append(sent_num)
+                        self.chains['chain_start'].append(start)
+                        self.chains['chain_end'].append(end)
+
+    def close(self):
+        """Save everything to the store's directory"""
+        os.makedirs(self.path,exist_ok=True)
+        for name,column in self.columns.items():
+            if name in INT_COLUMNS:
+                self.save(name,np.array(column,dtype=np.int32))
+            else:
+                self.save(name + '.codes',np.array(column,dtype=np.int32))
+                self.save(name + '.vocab',np.array(list(self.vocabs[name]),dtype=str))
+        for name,column in self.chains.items():
+            self.save(name,np.array(column,dtype=np.int32))
+        self.save('doc_offsets',np.array(self.docOffsets + [len(self.columns['doc_id'])],dtype=np.int64))
+        self.save('part_docs',np.array(self.partDocs,dtype=np.int32))
+        self.save('part_nums',np.array(self.partNums,dtype=np.int32))
+        self.save('part_offsets',np.array(self.partOffsets + [len(self.columns['doc_id'])],dtype=np.int64))
+        self.save('chain_offsets',np.array(self.chainOffsets + [len(self.chains['chain_sent'])],dtype=np.int64))
+
+    def save(self,name,values):
+        np.save(os.path.join(self.path,name + '.npy'),values)
+
+class FeatureStore(object):
+    """Read access to a feature store written by FeatureWriter. Opening one only reads the document and part indexes;
+    the columns themselves are memory-mapped, so a single part can be read without loading the rest of the corpus."""
+
+    def __init__(self,path):
+        self.path = path
+        self.columns = dict()
+        self.vocabs = dict()
+        for name in FEATURE_NAMES:
+            if name in INT_COLUMNS:
+                self.columns[name] = self.load(name)
+            else:
+                self.columns[name] = self.load(name + '.codes')
+                self.vocabs[name] = self.load(name + '.vocab')
+
+        self.docs = self.vocabs['doc_id'].tolist()
+        self.docOffsets = self.load('doc_offsets').tolist()
+        self.chainColumns = [self.load(name) for name in CHAIN_COLUMNS]
+
+        self.partOffsets = self.load('part_offsets').tolist()
+        self.chainOffsets = self.load('chain_offsets').tolist()
+        self.partIndex = dict()
+        self.docParts = {doc_id:[] for doc_id in self.docs}
+        for part,(doc,partnum) in enumerate(zip(self.load('part_docs').tolist(),self.load('part_nums').tolist())):
+            self.partIndex[(self.docs[doc],partnum)] = part
+            self.docParts[self.docs[doc]].append(partnum)
+
+    def load(self,name):
+        return np.load(os.path.join(self.path,name + '.npy'),mmap_mode='r')
+
+    def part_range(self,doc_id,part_num):
+        """Get the (start, end) rows of a part"""
+        part = self.partIndex[(doc_id,part_num)]
+        return (self.partOffsets[part],self.partOffsets[part+1])
+
+    def parts(self,doc_id):
+        """Get the part numbers of a document, in order"""
+        return self.docParts[doc_id]
+
+    def slice(self,start,end):
+        """Get the columns for rows start to end, decoded, as a dictionary of arrays in FEATURE_NAMES order"""
+        columns = dict()
+        for name in FEATURE_NAMES:
+            values = np.asarray(self.columns[name][start:end])
+            if name in self.vocabs:
+                values = self.vocabs[name][values]
+            columns[name] = values
+        return columns
+
+    def part(self,doc_id,part_num):
+        """Get the columns for all the rows of a part (see slice)"""
+        return self.slice(*self.part_range(doc_id,part_num))
+
+    def rows(self,start=0,end=None):
+        """Stream rows start to end (default: all of them) as feature tuples, with part_num, sent_num and word_num as ints"""
+        if end is None:
+            end = self.docOffsets[-1]
+        columns = []
+        for name in FEATURE_NAMES:
+            values = self.columns[name][start:end].tolist()
+            if name in self.vocabs:
+                vocab = self.vocabs[name]
+                decoded = dict()
+                for code in values:
+                    if code not in decoded:
+                        decoded[code] = str(vocab[code])
+                values = [decoded[code] for code in values]
+            columns.append(values)
+        return zip(*columns)
+
+    def parse_bits(self,doc_id=None,part_num=None):
+        """Get the (word, pos, parse_bit) rows of every sentence, which is everything needed to build its tree.
+        Give a doc_id and part_num to only read that part.
+        Returns:
+            A dictionary indexed by (doc_id, part_num, sent_num) (all strings), holding a list of rows for each sentence
+        """
+        if doc_id is None:
+            rows = self.rows()
+        else:
+            rows = self.rows(*self.part_range(doc_id,part_num))
+        sentences = dict()
+        for row in rows:
+            key = (row[0],str(row[1]),str(row[2]))
+            try:
+                sentences[key].append(row[4:7])
+            except KeyError:
+                sentences[key] = [row[4:7]]
+        return sentences
+
+    def part_mentions(self,doc_id,part_num):
+        """Get every mention of one part as an array of MENTION_DTYPE, chain by chain in the order the chains first appear"""
+        part = self.partIndex[(doc_id,part_num)]
+        start,end = self.chainOffsets[part],self.chainOffsets[part+1]
+
+        mentions = np.empty(end-start,dtype=MENTION_DTYPE)
+        for field,column in zip(MENTION_DTYPE.names,self.chainColumns):
+            mentions[field] = column[start:end]
+        return mentions
@@ -0,0 +1,22 @@
+"""Word lists shared by the sieve modules, e.g. stopwords.
+
+Each list is loaded the first time it's asked for and kept as a frozenset, so a module can look it up on every call
+without reloading it, and the corpora behind it (nltk's, for stopwords) aren't imported until some module needs them.
+"""
+
+#The lexicons loaded so far, by (name, language)
+loaded = dict()
+
+def load_stopwords(language):
+    from nltk.corpus import stopwords
+    return stopwords.words(language)
+
+#How to load each lexicon, given a language
+LOADERS = {'stopwords':load_stopwords}
+
+def lexicon(name,language='english'):
+    """Get a lexicon (one of LOADERS) as a frozenset of words, loading it if this is the first time it's been asked for"""
+    key = (name,language)
+    if key not in loaded:
+        loaded[key] = frozenset(LOADERS[name](language))
+    return loaded[key]
@@ -1,83 +1,79 @@
-import pickle
-import pandas as pd
+import time
+
+#When this process started loading the sieve, for reporting the startup time
+STARTED = time.perf_counter()
+
+import argparse
+import io
+import os
+import json
+import zlib
+from multiprocessing import Pool
+from multiprocessing.util import Finalize
+import numpy as np
 import sieve_modules
-import csv
-from string import punctuation
-from preprocess import get_trees
-
-FEAT_PICKLE = '../coref.pickle'
-FEAT_FILE = '../coref.feat'
+from clusters import MentionClusters
+from featstore import FeatureStore,FEATURE_NAMES
+from attrcache import GENDER_CACHE,AttributeCache
+from pagestore import PREFETCH_WORKERS,LOOKUP_TIMEOUT,open_pages
+from stats import PartStats,write_records,summarize
+
+FEAT_STORE = '../coref.store'
+RESULTS_DIR = '../new_results'
+MANIFEST_NAME = 'manifest-{}-of-{}.json'
 IMPLEMENTED_MODULES = [sieve_modules.module1,sieve_modules.module2,sieve_modules.module3,sieve_modules.module7]
 
-def print_groupings(f,part_df,filename,part_num,groupings):
-    """Change the DF of this filename and part number to our found mention chain. Then, print the entire DF.
+def print_groupings(f,part,filename,part_num,groupings):
+    """Write out the DF of this filename and part number, with our found mention chains in place of the original corefs column.
     Inputs:
       f - File object for the document we're writing to
-      part_df - The dataframe filtered to the appropriate filename and part number
+      part - The columns of the appropriate filename and part number, as returned by FeatureStore.part
       filename - The document name
       part_num - The part number
-      groupings - Our list of lists, each element being a list of mentions (a tuple of a sentence number and a word span)
+      groupings - Our list of lists, each element being a list of mentions (a tuple of a sentence number and the first and last word numbers)
     """
-    #Document header
-    f.write("#begin document (" + filename + "); part " + format(part_num,'03') + '\n')
+    sent_nums = np.asarray(part['sent_num']).tolist()
+    word_nums = np.asarray(part['word_num'])
 
-    #Change the data frame to reflect our custom groupings
-    #The first time we add a grouping number to a particular word, we also add an underscore to the beginning.
-    #That way, if we need to add another grouping number to it, we know that it's already been changed to reflect OUR groupings
+    #Sentences are contiguous and their words are numbered from 0, so a word's row is its sentence's first row plus its word number
+    sentStarts = {sent_nums[row]:row for row in np.flatnonzero(word_nums == 0).tolist()}
+
+    #Collect the chain markers for each word that starts or ends a mention, in the order the chains and mentions come in
+    markers = {}
     for i,chain in enumerate(groupings):
-        for sent_num,word_span in chain:
-            sent_num = int(sent_num)
+        label = str(i)
+        for sent_num,start,end in chain:
+            row = sentStarts[sent_num]
 
             #multi-word mentions
-            if '_' in str(word_span):
-                start = int(word_span.split('_')[0])
-                end = int(word_span.split('_')[-1])
-
-                corefStart = part_df.loc[(part_df['sent_num'] == sent_num) & (part_df['word_num'] == start),'corefs'].get_values()[0]
-                corefEnd = part_df.loc[(part_df['sent_num'] == sent_num) & (part_df['word_num'] == end),'corefs'].get_values()[0]
-
-
-                if corefStart.startswith('_'):
-                    part_df.loc[(part_df['sent_num'] == sent_num) & (part_df['word_num'] == start),'corefs'] = corefStart + '|('+str(i)
-                else:
-                    part_df.loc[(part_df['sent_num'] == sent_num) & (part_df['word_num'] == start),'corefs'] = '_('+str(i)
-
-                if corefEnd.startswith('_'):
-                    part_df.loc[(part_df['sent_num'] == sent_num) & (part_df['word_num'] == end),'corefs'] = corefEnd + '|'+str(i)+')'
-                else:
-                    part_df.loc[(part_df['sent_num'] == sent_num) & (part_df['word_num'] == end),'corefs'] = '_'+str(i)+')'
+            if start != end:
+                markers.setdefault(row+start,[]).append('(' + label)
+                markers.setdefault(row+end,[]).append(label + ')')
 
             else: #single-word mentions
-                word_span = int(word_span)
-                coref = part_df.loc[(part_df['sent_num'] == sent_num) & (part_df['word_num'] == word_span),'corefs'].get_values()[0]
-                if coref.startswith('_'):
-                    part_df.loc[(part_df['sent_num'] == sent_num) & (part_df['word_num'] == word_span),'corefs'] = coref + '|('+str(i)+')'
-                else:
-                    part_df.loc[(part_df['sent_num'] == sent_num) & (part_df['word_num'] == word_span),'corefs'] = '_('+str(i)+')'
+                markers.setdefault(row+start,[]).append('(' + label + ')')
 
-    sentNum = 0
+    #Words that aren't in any of our chains keep the original corefs value
+    corefs = [value.strip('_') for value in np.asarray(part['corefs'],dtype=str).tolist()]
+    for row,rowMarkers in markers.items():
+        corefs[row] = '|'.join(rowMarkers)
 
-    #Write everything in the array to the file
-    for array in part_df.get_values():
-        line = ''
-        for i,value in enumerate(array):
+    #The sentence number isn't in the CONLL format, so it's left out, and there are a couple of other columns that we don't use before the corefs
+    columns = [np.asarray(part[name]).astype(str).tolist() for name in FEATURE_NAMES if name not in ('sent_num','corefs')]
 
-            #This is the sentence number. We don't want to write it because we put it in ourselves, it's not in the CONLL format.
-            #However, if it changes, we do want to put in a newline to separate sentences.
-            if i == 2:
-                if value > sentNum:
-                    f.write('\n')
-                    sentNum = value
-                continue
-            #this is where we're printing the corefs and adding a couple of other columns that we don't use
-            if i == 12:
-                line += '*\t*\t*\t'
-                value = value.strip('_')
-            line += str(value) + '\t'
+    #Document header
+    lines = ["#begin document (" + filename + "); part " + format(part_num,'03') + '\n']
 
-        f.write(line.strip() + '\n')
+    #Each row is joined once; a newline separates sentences
+    sentNum = 0
+    for row,values in enumerate(zip(*columns)):
+        if sent_nums[row] > sentNum:
+            lines.append('\n')
+            sentNum = sent_nums[row]
+        lines.append('\t'.join(values) + '\t*\t*\t*\t' + corefs[row] + '\n')
 
-    f.write("\n#end document\n")
+    lines.append("\n#end document\n")
+    f.write(''.join(lines))
 
 '''
 def merge_groupings(groupings):
@@ -115,51 +111,207 @@ def merge_groupings(groupings):
     return mergedGroupings
 '''
 
-if __name__ == '__main__':
-    #Load the starting coreference chains to get the mentions
-    with open(FEAT_PICKLE,'rb') as f:
-        coref_chains = pickle.load(f)
-
-    #Read the features and syntax trees
-    df = pd.read_csv(FEAT_FILE)
-    trees = get_trees(FEAT_FILE)
+def resolve_part(store,filename,part_num,g_log,stats=None):
+    """Run the sieve over one document/part number pair.
+    Inputs:
+      store - The FeatureStore to read the part from
+      filename - The document name
+      part_num - The part number
+      g_log - Gender log for pronoun-linking, used in sieve_modules.module7
+      stats - If given, a list to add the part's timing and counter records to (see stats.py)
+    Returns:
+      The part's CONLL output with our groupings, as written by print_groupings
+    """
+    partStats = None
+    if stats is not None:
+        partStats = PartStats(filename,part_num)
+
+    #Building trees needs nltk, so it's only loaded once there's a part to resolve
+    from syntax import TreeCache
+
+    #Don't need the whole store, since we're only looking at one document/part number pair at a time
+    part = store.part(filename,part_num)
+
+    #Trees are built on demand and cached, so each sentence is only built once while its part is being resolved
+    trees = TreeCache(store.parse_bits(filename,part_num))
+
+    #Index the part's words by position so the modules don't have to scan the columns for every lookup
+    tokens = sieve_modules.build_token_index(part)
+    quoteCounts = sieve_modules.build_quote_counts(part)
+
+    #get all the mentions for this filename/part
+    #to start with, every mention is in its own cluster
+    #Mentions starting at the same word are ordered the way module1 always has, by where their words first appear
+    spans = store.part_mentions(filename,part_num)
+    clusters = MentionClusters(spans,sieve_modules.mention_ranks(spans,tokens))
+    if partStats is not None:
+        partStats.mentions = len(clusters)
+        partStats.step('setup',len(clusters),clusters.count)
+
+    #Some parts don't have any mentions and that's ok
+    if len(clusters) > 0:
+
+        #Work out each mention's text, head, number, etc. once, rather than in every module
+        mentions = sieve_modules.build_mentions(clusters,tokens,quoteCounts,trees,filename,part_num)
+        if partStats is not None:
+            partStats.step('mentions',clusters.count,clusters.count)
+
+        #Each module merges clusters in place, so the next one picks up where it left off
+        for module in IMPLEMENTED_MODULES:
+            clustersIn = clusters.count
+
+            #Special call for module7, since it needs g_log, which holds data even between documents and part numbers
+            if module == sieve_modules.module7:
+                module(clusters,mentions,tokens,trees,filename,part_num,g_log)
+
+            else:
+                module(clusters,mentions,tokens,trees,filename,part_num)
+
+            if partStats is not None:
+                partStats.step(module.__name__,clustersIn,clusters.count)
+
+    #Print our findings; this is the only place the clusters get turned into lists
+    f = io.StringIO()
+    print_groupings(f,part,filename,part_num,clusters.groupings())
+    if partStats is not None:
+        partStats.step('output',clusters.count,clusters.count)
+        stats.extend(partStats.finish(clusters.count,trees))
+    return f.getvalue()
+
+def init_worker(store_path,keepStats=False):
+    """Set up a worker process with its own handle on the feature store and the gender cache.
+    The cache file is shared by all the workers, and is flushed when the worker exits.
+    With keepStats, each part's stats records are sent back along with its output."""
+    global worker_store,worker_g_log,worker_stats
+    worker_store = FeatureStore(store_path)
+    worker_stats = keepStats
+    worker_g_log = AttributeCache(GENDER_CACHE)
+    Finalize(worker_g_log,worker_g_log.close,exitpriority=10)
+
+def resolve_part_in_worker(part):
+    """Run resolve_part for a (filename, part_num) pair in a worker process set up by init_worker
+    Returns:
+      The part's output, and its stats records (an empty list unless init_worker was asked to keep them)
+    """
+    filename,part_num = part
+    records = [] if worker_stats else None
+    return resolve_part(worker_store,filename,part_num,worker_g_log,records),records or []
+
+def keep_stats(results,stats):
+    """Pass on the output of each part from resolve_part_in_worker, adding its stats records to stats"""
+    for output,records in results:
+        stats.extend(records)
+        yield output
+
+def results_name(filename):
+    """The name of the .results file for a document"""
+    return filename.split('/')[-1] + '.results'
+
+def in_shard(filename,shard,num_shards):
+    """Check whether a document belongs to the given shard (numbered from 0) when the corpus is split into num_shards.
+    Documents are assigned by a hash of their name, so every node agrees on the split no matter which documents it sees or in what order."""
+    return zlib.crc32(filename.encode('utf8')) % num_shards == shard
+
+def parse_shard(value):
+    """Parse a --shard value of the form i/n into (i, n)"""
+    try:
+        shard,num_shards = (int(x) for x in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected i/n, e.g. 0/4')
+    if not 0 <= shard < num_shards:
+        raise argparse.ArgumentTypeError('shard must be between 0 and ' + str(num_shards-1))
+    return (shard,num_shards)
+
+def write_results(parts,outputs,results_dir=RESULTS_DIR):
+    """Write each part's output to the .results file of its document in results_dir.
+    parts and outputs are in the same order, and each document's parts are next to each other."""
+    f = None
+    current = None
+    for (filename,part_num),output in zip(parts,outputs):
+        if filename != current:
+            if f is not None:
+                f.close()
+            f = open(os.path.join(results_dir,results_name(filename)),'w',encoding='utf8')
+            current = filename
+        f.write(output)
+    if f is not None:
+        f.close()
+
+def prefetch_attributes(store,docs,source,workers,timeout):
+    """Work out the gender and plurality of every NP in the given documents before the sieve starts, so the caches module7
+    reads from are already warm. See npfeats.prefetch_nps."""
+    #These are only needed for prefetching
+    import npfeats
+    import preprocess
+
+    #Only the selected documents' sentences are parsed, not the whole store
+    nps = [phrase for filename in docs for part_num in store.parts(filename)
+           for phrase in preprocess.get_part_nps(store,filename,part_num)]
+    log_g,log_p = npfeats.load_logs()
+    checked,timedOut = npfeats.prefetch_nps(nps,log_g,log_p,open_pages(source,timeout),workers,timeout)
+    log_g.close()
+    log_p.close()
+    print('Prefetched ' + str(checked) + ' NPs (' + str(timedOut) + ' timed out)')
+
+def write_manifest(docs,shard,num_shards,results_dir=RESULTS_DIR):
+    """Record which documents this shard resolved, and which .results file each went to, for merge.py"""
+    manifest = {'shard':shard,'num_shards':num_shards,'docs':{filename:results_name(filename) for filename in docs}}
+    with open(os.path.join(results_dir,MANIFEST_NAME.format(shard,num_shards)),'w',encoding='utf8') as f:
+        json.dump(manifest,f,indent=1)
 
-    #Gender log for pronoun-linking, used in sieve_modules.module7
-    #Allows us to look up entity in wikipedia only once
-    g_log = {}
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Apply the sieve modules to the featurized CONLL data')
+    parser.add_argument('--doc',action='append',help='only resolve this document (e.g. nw/wsj/23/wsj_2300); can be given more than once')
+    parser.add_argument('--workers',type=int,default=1,help='number of processes to resolve parts with (default: 1)')
+    parser.add_argument('--shard',type=parse_shard,help='only resolve shard i of n (numbered from 0, e.g. 0/4), and write a manifest for merge.py')
+    parser.add_argument('--results-dir',default=RESULTS_DIR,help='where to write the .results files (default: ' + RESULTS_DIR + ')')
+    parser.add_argument('--prefetch',metavar='PAGES',help='before resolving, look up every NP\'s gender and plurality in PAGES (a page store, "wikipedia", or a MediaWiki API URL; see npfeats.py)')
+    parser.add_argument('--prefetch-workers',type=int,default=PREFETCH_WORKERS,help='number of NPs to look up at once when prefetching (default: ' + str(PREFETCH_WORKERS) + ')')
+    parser.add_argument('--lookup-timeout',type=float,default=LOOKUP_TIMEOUT,help='seconds to give each NP when prefetching (default: ' + str(LOOKUP_TIMEOUT) + ')')
+    parser.add_argument('--stats',metavar='PATH',help='record the time, merges and cache hits of every sieve module on every part as JSON lines in PATH, and print a summary by genre (see stats.py)')
+    args = parser.parse_args()
+
+    #Opening the store only reads its indexes; each part's rows are read as we get to it
+    store = FeatureStore(FEAT_STORE)
+
+    docs = args.doc or store.docs
+    if args.shard:
+        docs = [filename for filename in docs if in_shard(filename,*args.shard)]
+
+    prefetchTime = 0
+    if args.prefetch:
+        prefetchStart = time.perf_counter()
+        prefetch_attributes(store,docs,args.prefetch,args.prefetch_workers,args.lookup_timeout)
+        prefetchTime = time.perf_counter() - prefetchStart
 
     #Go document name by document name, part number by part number
-    for filename in coref_chains:
-        file_chains = coref_chains[filename]
-
-
-        with open('../new_results/' + filename.split('/')[-1]+'.results','w',encoding='utf8') as f:
-            for part_num in file_chains:
-
-                groupings = []
-                part_chains = file_chains[part_num]
-
-                #Don't need to pass the whole dataframe around, since we're only looking at one document/part number pair at a time
-                sub_df = df[(df['doc_id'] == filename) & (df['part_num'] == part_num)]
-
-                #get all the mentions for this filename/part
-                #to start with, every mention is in its own grouping
-                for chain in part_chains:
-                    chain_groupings = [[(tuple[0],str(tuple[1]))] for tuple in part_chains[chain]]
-                    groupings.extend(chain_groupings)
-
-                #Some parts don't have any mentions and that's ok
-                if groupings != []:
-
-                    #For each module, pass in the current groupings and get back the new (and hopefully improved) groupings
-                    for module in IMPLEMENTED_MODULES:
-
-                        #Special call for module7, since it needs g_log, which holds data even between documents and part numbers
-                        if module == sieve_modules.module7:
-                            groupings = module(groupings,sub_df,trees,filename,part_num,g_log)
-
-                        else:
-                            groupings = module(groupings,sub_df,trees,filename,part_num)
-
-                #Print our findings
-                print_groupings(f,sub_df,filename,part_num,groupings)
+    parts = [(filename,part_num) for filename in docs for part_num in store.parts(filename)]
+
+    #Startup is everything up to here but prefetching: loading the modules, parsing the arguments and opening the store
+    print('Started in ' + format(time.perf_counter() - STARTED - prefetchTime,'.2f') + 's')
+
+    #Timing and counter records of every part, if we're keeping them
+    stats = []
+
+    if args.workers > 1:
+        #Each worker reads just the parts it's given from the store. imap hands the results back in order, so the output is the same as with one process
+        with Pool(args.workers,initializer=init_worker,initargs=(FEAT_STORE,bool(args.stats))) as pool:
+            write_results(parts,keep_stats(pool.imap(resolve_part_in_worker,parts),stats),args.results_dir)
+
+            #Let the workers exit on their own, so they flush their gender caches
+            pool.close()
+            pool.join()
+    else:
+        #Gender log for pronoun-linking, used in sieve_modules.module7
+        #Allows us to look up each entity only once, in this run or any earlier one
+        g_log = AttributeCache(GENDER_CACHE)
+        partStats = stats if args.stats else None
+        write_results(parts,(resolve_part(store,filename,part_num,g_log,partStats) for filename,part_num in parts),args.results_dir)
+        g_log.close()
+
+    if args.shard:
+        write_manifest(docs,*args.shard,args.results_dir)
+
+    if args.stats:
+        write_records(stats,args.stats)
+        print(summarize(stats))
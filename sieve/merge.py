@@ -0,0 +1,83 @@
+import argparse
+import glob
+import json
+import os
+import shutil
+import sys
+from featstore import FeatureStore
+
+FEAT_STORE = '../coref.store'
+RESULTS_DIR = '../new_results'
+
+def load_manifests(shard_dirs):
+    """Load every shard manifest written by main.py --shard in the given directories
+    Returns:
+        A list of (directory, manifest) tuples
+    """
+    manifests = []
+    for shard_dir in shard_dirs:
+        for path in sorted(glob.glob(os.path.join(shard_dir,'manifest-*-of-*.json'))):
+            with open(path,encoding='utf8') as f:
+                manifests.append((shard_dir,json.load(f)))
+    return manifests
+
+def check_manifests(manifests,docs=None):
+    """Check that the shards make up exactly one full run: every shard of the split is there once, every document
+    was resolved by exactly one shard (and, if docs is given, every one of those documents was resolved), and every
+    .results file exists.
+    Returns:
+        A list of problems, which is empty if everything checks out
+    """
+    problems = []
+    if manifests == []:
+        return ['no shard manifests found']
+
+    num_shards = {manifest['num_shards'] for shard_dir,manifest in manifests}
+    if len(num_shards) > 1:
+        problems.append('shards come from different splits: ' + ', '.join(str(n) for n in sorted(num_shards)) + ' shards')
+
+    shards = [manifest['shard'] for shard_dir,manifest in manifests]
+    for shard in range(max(num_shards)):
+        if shards.count(shard) != 1:
+            problems.append('shard ' + str(shard) + ' appears ' + str(shards.count(shard)) + ' times')
+
+    seen = {}
+    for shard_dir,manifest in manifests:
+        for filename,results in manifest['docs'].items():
+            if filename in seen:
+                problems.append(filename + ' is in shards ' + str(seen[filename]) + ' and ' + str(manifest['shard']))
+            seen[filename] = manifest['shard']
+            if not os.path.exists(os.path.join(shard_dir,results)):
+                problems.append(filename + ' is missing its results file ' + os.path.join(shard_dir,results))
+
+    if docs is not None:
+        for filename in docs:
+            if filename not in seen:
+                problems.append(filename + ' is not in any shard')
+
+    return problems
+
+def merge_results(manifests,out_dir):
+    """Copy every shard's .results files into out_dir, so the evaluator sees a single full-corpus output set"""
+    os.makedirs(out_dir,exist_ok=True)
+    for shard_dir,manifest in manifests:
+        for results in manifest['docs'].values():
+            source = os.path.join(shard_dir,results)
+            dest = os.path.join(out_dir,results)
+            if os.path.abspath(source) != os.path.abspath(dest):
+                shutil.copyfile(source,dest)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check and merge the .results files of a sharded sieve run (main.py --shard)')
+    parser.add_argument('shard_dirs',nargs='+',help='directories holding the shards\' .results files and manifests')
+    parser.add_argument('--store',default=FEAT_STORE,help='feature store whose documents must all be covered (default: ' + FEAT_STORE + ')')
+    parser.add_argument('--out',default=RESULTS_DIR,help='where to put the merged .results files (default: ' + RESULTS_DIR + ')')
+    args = parser.parse_args()
+
+    manifests = load_manifests(args.shard_dirs)
+    problems = check_manifests(manifests,FeatureStore(args.store).docs)
+    if problems != []:
+        sys.exit('Not merging:\n' + '\n'.join(problems))
+
+    merge_results(manifests,args.out)
+    print('Merged ' + str(sum(len(manifest['docs']) for shard_dir,manifest in manifests)) + ' documents from ' + str(len(manifests)) + ' shards into ' + args.out)
@@ -1,13 +1,33 @@
-import wikipedia
-import preprocess
+import argparse
+import os
+import time
+import threading
+from queue import Queue,Empty
+from pagestore import PAGE_STORE,PREFETCH_WORKERS,LOOKUP_TIMEOUT,open_pages
+from attrcache import GENDER_CACHE,PLURALITY_CACHE,AttributeCache,normalize_np
 
 MALE = ['he', 'him', 'his']
 FEMALE = ['she', 'her']
 NEUTRAL = ['it', 'they', 'its', 'their']
 DETERMINERS = ['the','a','an','this','these','that','those','my', 'your', 'his', 'her', 'its', 'our', 'their']
 
+#How often (in seconds) prefetch_nps checks on the NPs it's waiting for
+POLL_INTERVAL = 0.1
 
-def check_gender(np,log):
+#The page source used when none is given (see pagestore); opened the first time it's needed
+default_pages = None
+
+def get_pages(pages=None):
+	"""Get the page source to look NPs up in: the one given, or else the local page store at pagestore.PAGE_STORE"""
+	global default_pages
+	if pages is not None:
+		return pages
+	if default_pages is None:
+		default_pages = open_pages(PAGE_STORE)
+	return default_pages
+
+
+def check_gender(np,log,pages=None):
 	if np in log:
 		return log[np]
 	else:
@@ -20,22 +40,25 @@ def check_gender(np,log):
 			if np in NEUTRAL:
 				return 'neutral'
 		if tempnp[0] in DETERMINERS:
-			tempnp = ' '.join(tempnp[1:])
+			tempnp = tempnp[1:]
+		tempnp = ' '.join(tempnp)
+		pages = get_pages(pages)
 		summary = []
+		#A LookupError means there's no such page (or no second search result)
 		try:
-			summary = wikipedia.summary(tempnp).split(' ')
-		except:
+			summary = pages.summary(tempnp).split(' ')
+		except LookupError:
 			try:
-				queries = wikipedia.search(tempnp)
-				summary = wikipedia.summary(queries[1]).split(' ') #to avoid disambiguation errors
-			except:
+				queries = pages.search(tempnp)
+				summary = pages.summary(queries[1]).split(' ') #to avoid disambiguation errors
+			except LookupError:
 				try:
-					summary = wikipedia.summary(np).split(' ')
-				except:
+					summary = pages.summary(np).split(' ')
+				except LookupError:
 					try:
-						queries = wikipedia.search(np)
-						summary = wikipedia.summary(queries[1]).split(' ') #to avoid disambiguation errors
-					except:
+						queries = pages.search(np)
+						summary = pages.summary(queries[1]).split(' ') #to avoid disambiguation errors
+					except LookupError:
 						pass
 
 		if summary != []:
@@ -58,7 +81,7 @@ def check_gender(np,log):
 				return 'neutral'
 	return 'undetermined'
 
-def check_plurality(np,log):
+def check_plurality(np,log,pages=None):
 	if np in log:
 		return log[np]
 	else:
@@ -70,14 +93,15 @@ def check_plurality(np,log):
 				return 'plural-det'
 			if np[0] in ['the','a','an','this','that']:
 				return 'single-det'
+		pages = get_pages(pages)
 		page = None
 		try:
-			page = wikipedia.page(np)
-		except:
+			page = pages.page(np)
+		except LookupError:
 			try:
-				queries = wikipedia.search(np)
-				page = wikipedia.page(queries[1]) #to avoid disambiguation errors
-			except:
+				queries = pages.search(np)
+				page = pages.page(queries[1]) #to avoid disambiguation errors
+			except LookupError:
 				pass
 
 		if page != None:
@@ -101,43 +125,125 @@ def check_plurality(np,log):
 	return 'undetermined'
 
 
-def quick_check(np):
-	return (check_gender(np,{}),check_plurality(np,{}))
+def lookup_queries(np):
+	"""The titles check_gender and check_plurality look up first for an NP"""
+	tempnp = np.split(' ')
+	if tempnp[0] in DETERMINERS:
+		return [' '.join(tempnp[1:]),np]
+	return [np]
+
+def prefetch_nps(nps,log_g,log_p,pages=None,workers=PREFETCH_WORKERS,timeout=LOOKUP_TIMEOUT):
+	"""Fill the gender and plurality logs for many NPs ahead of time (e.g. before the sieve runs).
+	The NPs are normalized and deduplicated, and the ones already in both logs are skipped. The pages the rest need are looked up
+	in one batch if the source can do that, then the NPs are checked on workers threads, so slow lookups overlap.
+	An NP still being checked after timeout seconds is given up on and left out of the logs, so it's tried again next time.
+	Its thread is left to finish in the background (with a new one taking its place), and since the threads are daemons,
+	one that never finishes doesn't keep the process from exiting.
+	Returns:
+	  (the number of NPs checked, the number given up on)
+	"""
+	pages = get_pages(pages)
+	todo = [np for np in dict.fromkeys(normalize_np(np) for np in nps) if np not in log_g or np not in log_p]
+	pages.prefetch([query for np in todo for query in lookup_queries(np)])
+
+	waiting = Queue()
+	for np in todo:
+		waiting.put(np)
+	results = Queue()
+
+	#When each NP started being checked, so it only gets timed once it's off the queue
+	started = dict()
+	def check_nps():
+		while True:
+			try:
+				np = waiting.get_nowait()
+			except Empty:
+				return
+			started[np] = time.monotonic()
+			try:
+				results.put((np,quick_check(np,pages),None))
+			except Exception as e:
+				results.put((np,None,e))
+
+	def start_worker():
+		threading.Thread(target=check_nps,daemon=True).start()
+
+	for i in range(min(workers,len(todo))):
+		start_worker()
 
-def quick_check_logs(np,log_g,log_p):
-	log_g[np.replace('_',' ').lower()] = check_gender(np.replace('_',' ').lower(),log_g)
-	log_p[np.replace('_',' ').lower()] = check_plurality(np.replace('_',' ').lower(),log_p)
-	return (log_g[np.replace('_',' ').lower()],log_p[np.replace('_',' ').lower()],log_g,log_p)
+	pending = set(todo)
+	timedOut = 0
+	while pending:
+		try:
+			np,attributes,error = results.get(timeout=POLL_INTERVAL)
+			#A result for an NP that's been given up on is thrown away
+			if np in pending:
+				pending.remove(np)
+				if error is not None:
+					raise error
+				log_g[np],log_p[np] = attributes
+		except Empty:
+			pass
+		now = time.monotonic()
+		for np in list(pending):
+			if np in started and now - started[np] > timeout:
+				pending.remove(np)
+				timedOut += 1
+				start_worker()
+
+	return (len(todo)-timedOut,timedOut)
+
+def quick_check(np,pages=None):
+	return (check_gender(np,{},pages),check_plurality(np,{},pages))
+
+def quick_check_logs(np,log_g,log_p,pages=None):
+	np = normalize_np(np)
+	log_g[np] = check_gender(np,log_g,pages)
+	log_p[np] = check_plurality(np,log_p,pages)
+	return (log_g[np],log_p[np],log_g,log_p)
+
+def import_log(filename,log):
+	"""Add the entries of an old genders.txt/plurality.txt log (np|SPLIT|value lines) that aren't in log yet"""
+	with open(filename,encoding='utf8') as f:
+		for line in f:
+			np,sep,value = line.rstrip('\n').partition('|SPLIT|')
+			if sep and np not in log:
+				log[np] = value
 
 def load_logs():
-	log_g = {}
-	log_p = {}
-	with open('genders.txt',encoding='utf8') as genders:
-		for line in genders:
-			log_g[line.split('|SPLIT|')[0]] = line.split('|SPLIT|')[1]
-	with open('plurality.txt',encoding='utf8') as plurality:
-		for line in plurality:
-			log_p[line.split('|SPLIT|')[0]] = line.split('|SPLIT|')[1]
+	"""Open the persistent gender and plurality caches (see attrcache), bringing in any old genders.txt and plurality.txt"""
+	log_g = AttributeCache(GENDER_CACHE)
+	log_p = AttributeCache(PLURALITY_CACHE)
+	for filename,log in (('genders.txt',log_g),('plurality.txt',log_p)):
+		if os.path.exists(filename):
+			import_log(filename,log)
 	return log_g,log_p
 
 def save_logs(log_g,log_p):
-	with open('genders.txt','w',encoding='utf8') as genders:
-		for np in log_g:
-			genders.write(np+'|SPLIT|'+log_g[np]+'\n')
-	with open('plurality.txt','w',encoding='utf8') as plurality:
-		for np in log_p:
-			plurality.write(np+'|SPLIT|'+log_p[np]+'\n')
+	"""Write out whatever the caches haven't written yet"""
+	log_g.flush()
+	log_p.flush()
 
 if __name__ == '__main__':
-	#log_g,log_p = load_logs()
-	feats = 'coref.feat'
+	parser = argparse.ArgumentParser(description='Work out the gender and plurality of every NP in the feature store')
+	parser.add_argument('--workers',type=int,default=PREFETCH_WORKERS,help='number of NPs to check at once (default: ' + str(PREFETCH_WORKERS) + ')')
+	parser.add_argument('--timeout',type=float,default=LOOKUP_TIMEOUT,help='seconds to give each NP before moving on without it (default: ' + str(LOOKUP_TIMEOUT) + ')')
+	parser.add_argument('--pages',default=PAGE_STORE,help='where to look NPs up: a page store built by pagestore.py, "wikipedia", or the URL of a MediaWiki API server (default: ' + PAGE_STORE + ')')
+	args = parser.parse_args()
+
+	#Only needed to find the NPs
+	import preprocess
+
+	log_g,log_p = load_logs()
+	feats = 'coref.store'
 	sent_nps = preprocess.get_nps(feats)
-	log_g = {}
-	log_p = {}
+	nps = []
 	for np_list in sent_nps:
 		for np in sent_nps[np_list]:
 			temp = np.replace('_',' ')
 			print(temp)
-			log_g[temp.lower()] = check_gender(temp.lower(),log_g)
-			log_p[temp.lower()] = check_plurality(temp.lower(),log_p)
-	save_logs(log_g,log_p)
+			nps.append(temp.lower())
+	checked,timedOut = prefetch_nps(nps,log_g,log_p,open_pages(args.pages,args.timeout),args.workers,args.timeout)
+	log_g.close()
+	log_p.close()
+	print('Checked ' + str(checked) + ' NPs (' + str(timedOut) + ' timed out)')
@@ -0,0 +1,197 @@
+"""Sources of Wikipedia page summaries, for the gender and plurality rules in npfeats.
+
+The default source is a PageStore: a local SQLite database built from a Wikipedia dump, so looking up NPs needs no network
+and many of them can be looked up at once. Build one with
+    python pagestore.py DUMP [--out PATH]
+where DUMP is either Wikipedia's abstracts dump (enwiki-latest-abstract.xml, optionally gzipped) or a JSON lines file
+with a "title" and "summary" for each page.
+
+Live Wikipedia is only an optional fetcher (WikipediaPages). It can also be pointed at anything else that speaks the
+MediaWiki API, like a local stub server for testing.
+
+Every source has the same methods:
+    page(query)       - the Page (title and summary) for a title, raising LookupError if there isn't one
+    summary(query)    - just the summary of that page
+    search(query)     - a list of titles matching the query, best first
+    prefetch(queries) - look up many titles at once (if the source can), and keep the pages found for page() and summary()
+"""
+import argparse
+import gzip
+import json
+import os
+import sqlite3
+import threading
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+
+PAGE_STORE = '../pages.db'
+BATCH_SIZE = 500
+SEARCH_RESULTS = 10
+
+#How many NPs to look up at once when prefetching them (see npfeats.prefetch_nps), and how long to give each one, in seconds
+PREFETCH_WORKERS = 8
+LOOKUP_TIMEOUT = 30
+
+Page = namedtuple('Page',['title','summary'])
+
+def normalize_title(title):
+    """The form titles are stored and looked up in: lowercased, with underscores as spaces and runs of spaces collapsed"""
+    return ' '.join(title.replace('_',' ').lower().split())
+
+def read_dump(path):
+    """Stream (title, summary) pairs from a Wikipedia abstracts dump (.xml) or a JSON lines file, either of which may be gzipped"""
+    opener = gzip.open if path.endswith('.gz') else open
+    if path.endswith('.xml') or path.endswith('.xml.gz'):
+        with opener(path,'rb') as f:
+            for event,elem in ET.iterparse(f):
+                if elem.tag == 'doc':
+                    title = elem.findtext('title') or ''
+                    if title.startswith('Wikipedia: '):
+                        title = title[len('Wikipedia: '):]
+                    yield (title,elem.findtext('abstract') or '')
+                    elem.clear()
+    else:
+        with opener(path,'rt',encoding='utf8') as f:
+            for line in f:
+                if line.strip():
+                    page = json.loads(line)
+                    yield (page['title'],page['summary'])
+
+def build_page_store(dump,path=PAGE_STORE):
+    """Build a PageStore at path from a dump (see read_dump). If a title appears more than once, the first one is kept.
+    Returns:
+      The number of pages stored
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    db = sqlite3.connect(path)
+    db.execute('CREATE TABLE pages (key TEXT PRIMARY KEY, title TEXT, summary TEXT)')
+    batch = []
+    for title,summary in read_dump(dump):
+        batch.append((normalize_title(title),title,summary))
+        if len(batch) == BATCH_SIZE:
+            db.executemany('INSERT OR IGNORE INTO pages VALUES (?,?,?)',batch)
+            batch = []
+    db.executemany('INSERT OR IGNORE INTO pages VALUES (?,?,?)',batch)
+    db.commit()
+    count = db.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+    db.close()
+    return count
+
+class PageStore(object):
+    """Page summaries from a local SQLite database built by build_page_store. Titles are matched after normalize_title,
+    and search() finds the titles that start with the query, shortest first."""
+
+    def __init__(self,path=PAGE_STORE,timeout=LOOKUP_TIMEOUT):
+        """timeout is how many seconds a query waits for the database if it's locked (e.g. while the store is being rebuilt)"""
+        if not os.path.exists(path):
+            raise FileNotFoundError('No page store at ' + path + '; build one with pagestore.py')
+        self.path = path
+        #The connection is shared by all threads (e.g. those of npfeats.prefetch_nps), one query at a time
+        self.db = sqlite3.connect('file:' + path + '?mode=ro',uri=True,timeout=timeout,check_same_thread=False)
+        self.lock = threading.Lock()
+        self.found = dict()
+
+    def query(self,sql,params):
+        with self.lock:
+            return self.db.execute(sql,params).fetchall()
+
+    def page(self,query):
+        key = normalize_title(query)
+        if key in self.found:
+            return self.found[key]
+        rows = self.query('SELECT title,summary FROM pages WHERE key = ?',(key,))
+        if rows == []:
+            raise KeyError(query)
+        return Page(*rows[0])
+
+    def summary(self,query):
+        return self.page(query).summary
+
+    def search(self,query,results=SEARCH_RESULTS):
+        key = normalize_title(query)
+        if key == '':
+            return []
+        rows = self.query('SELECT title FROM pages WHERE key >= ? AND key < ? ORDER BY length(key),key LIMIT ?',
+                          (key,key + '\uffff',results))
+        return [title for (title,) in rows]
+
+    def prefetch(self,queries):
+        """Look up many titles in a few queries, keeping the pages found. Returns how many were found."""
+        keys = list({normalize_title(query) for query in queries} - set(self.found))
+        count = 0
+        for i in range(0,len(keys),BATCH_SIZE):
+            batch = keys[i:i+BATCH_SIZE]
+            rows = self.query('SELECT key,title,summary FROM pages WHERE key IN (' + ','.join('?'*len(batch)) + ')',batch)
+            for key,title,summary in rows:
+                self.found[key] = Page(title,summary)
+                count += 1
+        return count
+
+class TimedRequests(object):
+    """Stands in for the requests module inside the wikipedia package (which only calls requests.get), adding a timeout to every request"""
+
+    def __init__(self,requests,timeout):
+        self.requests = requests
+        self.timeout = timeout
+
+    def get(self,url,**kwargs):
+        kwargs.setdefault('timeout',self.timeout)
+        return self.requests.get(url,**kwargs)
+
+class WikipediaPages(object):
+    """Page summaries fetched live through the wikipedia package, which needs network access (and is slow).
+    Give an api_url to use another MediaWiki API server instead of Wikipedia's, e.g. a local stub for testing.
+    Every request to the server gives up after timeout seconds.
+    Anything that goes wrong with a lookup (no such page, a disambiguation page, a network error or timeout) is raised as a LookupError."""
+
+    def __init__(self,api_url=None,timeout=LOOKUP_TIMEOUT):
+        import requests
+        import wikipedia
+        if api_url is not None:
+            wikipedia.wikipedia.API_URL = api_url
+        #The wikipedia package makes its requests with no timeout, so a stuck server would hang the lookup for good
+        wikipedia.wikipedia.requests = TimedRequests(requests,timeout)
+        self.wikipedia = wikipedia
+        self.errors = (wikipedia.exceptions.WikipediaException,requests.exceptions.RequestException,KeyError,ValueError)
+
+    def page(self,query):
+        try:
+            page = self.wikipedia.page(query)
+            return Page(page.title,page.summary)
+        except self.errors as e:
+            raise LookupError(query) from e
+
+    def summary(self,query):
+        try:
+            return self.wikipedia.summary(query)
+        except self.errors as e:
+            raise LookupError(query) from e
+
+    def search(self,query,results=SEARCH_RESULTS):
+        try:
+            return self.wikipedia.search(query,results=results)
+        except self.errors:
+            return []
+
+    def prefetch(self,queries):
+        """The API is asked one title at a time, so there's nothing to gain by fetching ahead here.
+        To overlap many lookups, run them on several threads (as npfeats.prefetch_nps does)."""
+        return 0
+
+def open_pages(source=PAGE_STORE,timeout=LOOKUP_TIMEOUT):
+    """Open a page source: 'wikipedia' for live Wikipedia, the URL of another MediaWiki API server, or else the path of a PageStore.
+    No single request to the source waits more than timeout seconds."""
+    if source == 'wikipedia':
+        return WikipediaPages(timeout=timeout)
+    if source.startswith('http://') or source.startswith('https://'):
+        return WikipediaPages(source,timeout)
+    return PageStore(source,timeout)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a local page store for npfeats from a Wikipedia dump')
+    parser.add_argument('dump',help='the abstracts dump (.xml or .xml.gz) or a JSON lines file of {"title": ..., "summary": ...}')
+    parser.add_argument('--out',default=PAGE_STORE,help='where to write the store (default: ' + PAGE_STORE + ')')
+    args = parser.parse_args()
+
+    print('Stored ' + str(build_page_store(args.dump,args.out)) + ' pages in ' + args.out)
@@ -1,21 +1,18 @@
 #Extract entity pairs
 
 from __future__ import print_function
-import pickle
 import os
-import csv
 import random
-from nltk.tree import Tree
-from string import punctuation
-import pandas as pd
+import argparse
+from multiprocessing import Pool
+from featstore import FeatureWriter,FeatureStore,FEATURE_NAMES
 
 SAMPLE_ANNOTATION = '../../conll-2012/train/english/annotations/bc/cctv/00/cctv_0001.v4_auto_conll'
 CONLL_TRAIN = '../../conll-2012/train/'
 CONLL_DEV = '../../conll-2012/dev/'
 CONLL_TEST = '../../conll-2012/test/'
 
-TEST_FEAT_DEST = '../coref.feat'
-COREF_PICKLE_DEST = '../coref.pickle'
+TEST_FEAT_DEST = '../coref.store'
 
 """_conll files have the follwowing format:
 Column	Type	Description
@@ -34,22 +31,14 @@ Column	Type	Description
 N	Coreference	Coreference chain information encoded in a parenthesis structure.
 """
 
-FEATURE_NAMES = ("doc_id", "part_num","sent_num",
-            "word_num", "word", "pos",
-            "parse_bit", "pred_lemma", "pred_frame_id",
-            "sense","speaker","ne","corefs"
-            )
-
 def featurize_file(filename):
+    """Convert gold_conll file to features, streaming one word at a time
+    Input:
+        filename: path to gold_conll file
+    Output:
+        A generator of feature tuples (in FEATURE_NAMES order), one per word in the file
+    """
     with open(filename,'r',encoding='utf8') as source:
-        """Convert gold_conll file to features
-        Input:
-            filename: path to gold_conll file
-        Output:
-            featurized_words: a list of dicts of features, one dict per word in the file
-        TODO: feature processing (mostly strings now)
-        """
-        featurized_words = list()
         sent_count = 0
 
         for line in source:
@@ -59,134 +48,149 @@ def featurize_file(filename):
                 sent_count += 1
                 #print("On sent {}".format(sent_count)) #for debugging
             elif not attribs[0].startswith('#'): #if it's not a comment
-                feature_dict = dict()
                 sent_num = sent_count
                 doc_id, part_num, word_num, word, pos = attribs[:5]
                 parse_bit, pred_lemma, pred_frame_id, sense, speaker, ne = attribs[5:11]
-                args = attribs[11:-1] #a list
                 corefs = attribs[-1] #list of entity numbers,parens,and pipes e.g. (28), (42, 64), (28|(42
-                features = (doc_id, part_num, sent_num,word_num,word,pos,parse_bit,pred_lemma,pred_frame_id,sense,speaker,ne,corefs)
-                featurized_sent = {k:v for k,v in zip(FEATURE_NAMES,features)}
-                featurized_words.append(featurized_sent)
-        return featurized_words
+                yield (doc_id, part_num, sent_num,word_num,word,pos,parse_bit,pred_lemma,pred_frame_id,sense,speaker,ne,corefs)
 
 
+def find_conll_files(dirname):
+    """Find all the gold_conll files in a dir, in sorted order (directory by directory), so every checkout and every node
+    featurizes them in the same order and writes the same store"""
+    for root, dirnames, filenames in os.walk(dirname):
+        #os.walk lists entries in whatever order the filesystem keeps them; sorting dirnames in place makes it walk them in order
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.endswith('gold_conll'):
+                yield os.path.join(root,filename)
+
 def featurize_dir(dirname):
     """Featurize all files in a dir
     Input:
         dirname: path to conll directory
     Output:
-        list of list of dicts
+        A generator of feature tuples for every word of every file, file by file
     """
-    featurized_files = list()
-    for root, dirnames, filenames in os.walk(dirname):
+    for filename in find_conll_files(dirname):
+        yield from featurize_file(filename)
+
+def featurize_with_chains(filename):
+    """Featurize one gold_conll file and extract its coreference chains. This is the unit of work for parallel preprocessing.
+    Returns:
+        rows - The file's feature tuples
+        chains - The file's coreference chain dictionary (see build_coref_chains)
+    """
+    rows = list(featurize_file(filename))
+    return rows,build_coref_chains(rows)
+
+def featurize_corpus(dirname,workers=1):
+    """Featurize every gold_conll file in a dir along with its coreference chains.
+    With more than one worker, the files are spread over a process pool, but the results still come back in the order
+    the files were found, so the output doesn't depend on the number of workers.
+    Output:
+        A generator of (rows, chains) tuples, one per file (see featurize_with_chains)
+    """
+    filenames = list(find_conll_files(dirname))
+    if workers > 1:
+        with Pool(workers) as pool:
+            yield from pool.imap(featurize_with_chains,filenames)
+    else:
         for filename in filenames:
-            if filename.endswith('gold_conll'):
-                featurized_files.append(featurize_file(os.path.join(root,filename)))
-    return featurized_files
+            yield featurize_with_chains(filename)
 
-def write_csv(featurized_files):
-    """Write featurized files to csv
+def write_features(dirname,workers=1):
+    """Featurize a dir, writing every word and the coreference chains of each file to the feature store at TEST_FEAT_DEST.
+    Only one file's words are held in memory at a time (per worker), along with the store's integer columns.
     """
-    with open(TEST_FEAT_DEST,'w',encoding='utf8',newline='') as dest:
-        writer = csv.DictWriter(dest, fieldnames=FEATURE_NAMES)
-        writer.writeheader()
-        for featurized_file in featurized_files:
-            for featurized_word in featurized_file:
-                row = dict()
-                for feature_name in FEATURE_NAMES:
-                    feature = featurized_word[feature_name]
-                    if type(feature) is list:
-                        feature = ''.join(feature)
-                    row[feature_name] = feature
-                writer.writerow(row)
+    writer = FeatureWriter(TEST_FEAT_DEST)
+    for rows,chains in featurize_corpus(dirname,workers):
+        writer.write(rows,chains)
+    writer.close()
+
+def get_parse_bits(featfile):
+    """Get the (word, pos, parse_bit) rows of every sentence in a feature store, which is everything needed to build its tree
+    Returns:
+        A dictionary indexed by (doc_id, part_num, sent_num), holding a list of rows for each sentence
+    """
+    return FeatureStore(featfile).parse_bits()
 
 def get_trees(featfile):
-    """Get trees from a feature file
+    """Get trees from a feature store
+    Returns:
+        A dictionary indexed by (doc_id, part_num, sent_num), holding a SentenceTree for each sentence
     """
-    trees = dict()
-    with open(featfile,encoding='utf8') as source:
-        reader = csv.DictReader(source)
-        for row in reader:
-            key = (row['doc_id'],row['part_num'],row['sent_num'])
-            word = row['word']
-            pos = row['pos']
-            if word in punctuation:
-                pos = 'PUNC'
-                #word = '(PUNC {})'.format(word)
-            try:
-                trees[key] += row['parse_bit'].replace('*',' (' + pos + ' ' + word + ')')
-            except KeyError:
-                trees[key] = row['parse_bit'].replace('*',' (' + pos + ' ' + word + ')')
-    return trees
+    #Building trees needs nltk, which featurizing doesn't
+    from syntax import build_tree
+
+    return {key:build_tree(rows) for key,rows in get_parse_bits(featfile).items()}
+
+def tree_nps(tree):
+    """Get the NPs of a SentenceTree, each as its words joined by '_'"""
+    return ['_'.join(np.leaves()) for np in tree.tree.subtrees(filter=lambda x:x.label() == "NP")]
 
 def get_nps(featfile):
-    """Get trees from a feature file, then get NPs from trees
+    """Get trees from a feature store, then get NPs from trees
     Use these NPs to build coreference chains
     """
     np_dict = dict()
     trees = get_trees(featfile)
     for key in trees.keys():
-        tree = Tree.fromstring(trees[key])
-        nps = list(tree.subtrees(filter=lambda x:x.label() == "NP"))
-        for np in nps:
-            np_string = '_'.join(np.leaves())
-            try:
-                np_dict[key].append(np_string)
-            except KeyError:
-                np_dict[key] = [np_string]
+        nps = tree_nps(trees[key])
+        if nps:
+            np_dict[key] = nps
     return np_dict
 
-def build_coref_chains(featfile):
-    """Build coreference chains from featurized files
+def get_part_nps(store,doc_id,part_num):
+    """Get the NPs of one part of a FeatureStore, building trees for only that part's sentences
+    Returns:
+        A list of every NP in the part, in sentence order, as for get_nps
+    """
+    from syntax import build_tree
+
+    return [np for rows in store.parse_bits(doc_id,part_num).values() for np in tree_nps(build_tree(rows))]
+
+def build_coref_chains(rows):
+    """Build coreference chains from featurized files, in a single pass over the words in order
     Input:
-        featfile - Path to file where previous featurization was saved as a CSV
+        rows - Feature tuples for every word, in order, as streamed by featurize_file or featurize_dir
     Returns:
         A three-tiered dictionary, indexed by (in descending order) filename, part number, and coreference chain.
-        The bottom tier holds the most pertinent information: Sentence number and word number for each mention in the chain.
-        If it is a single-word mention, the word number will be a single value.
-        If it is a multi-word mention, the word number will be multiple values spaced by underscore (e.g., 5_6_7).
+        The bottom tier holds the most pertinent information: (sent_num, start, end) for each mention in the chain,
+        where start and end are the word numbers of its first and last words (the same for a single-word mention).
     """
-    #corefs = dict() #keys: (file, num). values: (sent, word_span)
-    df = pd.read_csv(featfile)
-    filenames = df.doc_id.unique()
     fileDict = dict()
-    for filename in filenames:
 
-        file_df = df[df['doc_id'] == filename]
-        partnums = file_df.part_num.unique()
-        partDict = dict()
+    #The still-open multi-word mentions for each filename and part number
+    openDicts = dict()
 
-        for partnum in partnums:
+    for row in rows:
+        filename = row[0]
+        partnum = int(row[1])
 
-            chainDict = dict()
-            part_df = file_df[file_df['part_num'] == partnum]
-            corefs = part_df[part_df['corefs'] != '-']
-            for coref in corefs.get_values():
-                sentNum = coref[2]
-                wordNum = coref[3]
-                refNum = coref[-1]
+        #Every filename and part number gets an entry, even if it has no mentions
+        partDict = fileDict.setdefault(filename,dict())
+        chainDict = partDict.setdefault(partnum,dict())
 
-                chainDict = match_corefs(chainDict,refNum,sentNum,wordNum)
+        refNum = row[-1]
+        if refNum != '-':
+            openDict = openDicts.setdefault((filename,partnum),dict())
+            match_corefs(chainDict,openDict,refNum,int(row[2]),int(row[3]))
 
-            partDict[partnum] = chainDict
-
-        fileDict[filename] = partDict
-
-        #corefs = file_df.corefs.unique()
-        #sents = file_df.sent_num.unique()
     return fileDict
 
-def match_corefs(chainDict,newCorefList,sentNum,wordNum):
+def match_corefs(chainDict,openDict,newCorefList,sentNum,wordNum):
     """
     Matches an explicit coreference mention to the appropriate chain for this file and part number.
     Input:
-        chainDict - A dictionary for each chain, indexed by the coreference chain's number. The values of the dictionary are lists of mentions.
+        chainDict - A dictionary for each chain, indexed by the coreference chain's number. The values of the dictionary are lists of completed mentions.
+        openDict - A dictionary for each chain with still-open multi-word mentions, indexed the same way.
+                   The values are stacks of the word numbers where those mentions began.
         newCorefList - The direct coref value from the CONLL format (e.g. (124) or (124|(113) or 113|124)
         sentNum - The sentence number of this mention, which is saved as part of the mention info
-        wordNum - The word number of this mention, which may be combined with previous word numbers for multi-word mentions
+        wordNum - The word number of this mention, which ends a multi-word mention if one is open
     Returns:
-        chainDict, but with the appropriate mentions added to coreference chain(s)
+        Nothing; the appropriate mentions are added to coreference chain(s) in chainDict as they are completed
     """
 
     #One word may be relevant to numerous chains, all split by |
@@ -198,88 +202,30 @@ def match_corefs(chainDict,newCorefList,sentNum,wordNum):
             #Single-word mention
             if newCoref.endswith(')'):
                 refNum = newCoref[1:-1]
-                chainDict = add_new_coref(chainDict,refNum,(sentNum,wordNum))
+                chainDict.setdefault(refNum,[]).append((sentNum,wordNum,wordNum))
 
             #Multi-word mention
             else:
                 refNum = newCoref[1:]
-                if refNum in chainDict:
-                    #here we are just saving the wordNum of the current word, which will be the beginning of the multi-word mention span
-                    chainDict[refNum].append(wordNum)
-                else:
-                    chainDict[refNum] = [wordNum]
+                #The chain is listed as soon as one of its mentions opens, so chains keep the order they first appear in
+                chainDict.setdefault(refNum,[])
+                #here we are just saving the wordNum of the current word, which will be the beginning of the multi-word mention span
+                openDict.setdefault(refNum,[]).append(wordNum)
 
         #ending a multi-word mention, which will have the format "##)"
         else:
             refNum = newCoref[:-1]
 
-            #get the latest still-open mention, and its number and all of the words in between
-            wordBegin = chainDict[refNum].pop()
-            span = ''
-            for i in range(wordBegin,wordNum+1):
-                span += str(i) + '_'
-            span = span.strip('_')
-
-
-            chainDict = add_new_coref(chainDict,refNum,(sentNum,span))
-
-    return chainDict
-
-def add_new_coref(chainDict,refNum,coref):
-    """Add a completed single- or multi-word mention to its coreference chain, taking into account
-    the fact that there might be still-open multi-word mentions in this same chain
-    Input:
-        chainDict - A dictionary for each chain, indexed by the coreference chain's number. The values of the dictionary are lists of mentions.
-        refNum - The index for chainDict
-        coref - The new (sentenceNumber,wordSpan) tuple to add to the coreference chain
-    Returns:
-        chainDict with coref added in between the previous completed mention (if any) and word numbers for still-open mentions (if any)
-    """
-
-    #simplest case, first time we've seen this number and it's a one-word mention
-    if refNum not in chainDict:
-        chainDict[refNum] = [coref]
-        return chainDict
-
-    chainList = chainDict[refNum]
-    openList = []
-
-    #Pop out and store all still-open mentions
-    if len(chainList) > 0:
-        while type(chainList[-1]) == int:
-            openList.append(chainList.pop())
-            if len(chainList) < 1:
-                break
-
-    chainList.append(coref)
-
-    #Add the popped-out still-open mentions back to the chain in their original order
-    while len(openList) > 0:
-        chainList.append(openList.pop())
+            #get the latest still-open mention, which runs from where it began to this word
+            wordBegin = openDict[refNum].pop()
 
-    return chainDict
+            chainDict[refNum].append((sentNum,wordBegin,wordNum))
 
 if __name__ == "__main__":
 
-    print("Featurizing...")
-    featurized_files = featurize_dir(CONLL_TEST)
+    parser = argparse.ArgumentParser(description='Convert the CONLL files for use with the sieve')
+    parser.add_argument('--workers',type=int,default=1,help='number of processes to featurize files with (default: 1)')
+    args = parser.parse_args()
 
-    print("Writing csv...")
-    write_csv(featurized_files)
-
-
-    print("Extracting coreference chains...")
-    #coref_dicts = build_coref_chains(featurized_files)
-    coref_dicts = build_coref_chains(TEST_FEAT_DEST)
-    with open(COREF_PICKLE_DEST,'wb') as f:
-        pickle.dump(coref_dicts,f,pickle.HIGHEST_PROTOCOL)
-    #print(coref_dicts[100].keys())
-    #for key in coref_dicts[100].keys():
-     #   print(coref_dicts[key])
-
-    """
-    print("Getting NPs")
-    nps = get_nps('../train.feat')
-    sample = nps[('nw/wsj/02/wsj_0290', '0', '47')]
-    print(sample)
-    """
+    print("Featurizing, extracting coreference chains and writing the feature store...")
+    write_features(CONLL_TEST,args.workers)
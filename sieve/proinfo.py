@@ -1,3 +1,5 @@
+import numpy as np
+
 SING = 0
 PLUR = 1
 ANIMATE = 2
@@ -117,4 +119,45 @@ GENDER_DICT = {'i': [M,F],
                'this': [N],
                'that': [N],
                'those': [N],
-               'these': [N]}
\ No newline at end of file
+               'these': [N]}
+
+#The lexicon compiled into bitmasks: bit c of a pronoun's mask is set if it can take property c (e.g. 1 << SING).
+#Checking whether two things agree on a property is then a bitwise AND instead of a set intersection.
+NUMBER_BITS = (1 << SING) | (1 << PLUR)
+ANIMACY_BITS = (1 << ANIMATE) | (1 << NONANIMATE)
+PERSON_BITS = (1 << FIRST) | (1 << SECOND) | (1 << THIRD)
+GENDER_BITS = (1 << M) | (1 << F) | (1 << N)
+
+def to_mask(properties):
+    """Combine a list of properties into a bitmask"""
+    mask = 0
+    for prop in properties:
+        mask |= 1 << prop
+    return mask
+
+def agrees(a,b,groups):
+    """Check whether masks a and b have at least one property in common from each of the given groups of bits.
+    a and b can be ints, or NumPy arrays of masks to check every pair at once (with the usual broadcasting)."""
+    result = True
+    for bits in groups:
+        result = result & ((a & b & bits) != 0)
+    return result
+
+PRONOUN_SET = frozenset(PRONOUN_LIST)
+PRONOUN_IDS = {pronoun:i for i,pronoun in enumerate(PRONOUN_LIST)}
+PRONOUN_MASKS = {pronoun:to_mask(NUMBER_DICT[pronoun] + ANIMATE_DICT[pronoun] + PERSON_DICT[pronoun] + GENDER_DICT[pronoun]) for pronoun in PRONOUN_LIST}
+PRONOUN_MASK_ARRAY = np.array([PRONOUN_MASKS[pronoun] for pronoun in PRONOUN_LIST],dtype=np.int32)
+
+def build_pronoun_agreement(checkPerson):
+    """Work out which pairs of pronouns can corefer, as a matrix indexed by PRONOUN_IDS.
+    A pronoun always matches itself; otherwise they have to agree in number, animacy and gender, and in person if checkPerson is set."""
+    a = PRONOUN_MASK_ARRAY[:,None]
+    b = PRONOUN_MASK_ARRAY[None,:]
+    agreement = agrees(a,b,(NUMBER_BITS,ANIMACY_BITS,GENDER_BITS)) | np.eye(len(PRONOUN_LIST),dtype=bool)
+    if checkPerson:
+        agreement &= (a & PERSON_BITS) == (b & PERSON_BITS)
+    return agreement
+
+#Pronoun-pronoun agreement, normally and when one of them is in quotes (so they're probably from different speakers, and person doesn't have to match)
+PRONOUN_AGREEMENT = build_pronoun_agreement(True)
+PRONOUN_AGREEMENT_IN_QUOTES = build_pronoun_agreement(False)
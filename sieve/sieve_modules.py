@@ -1,10 +1,34 @@
-import pandas as pd
-from nltk.tree import Tree
-from nltk.corpus import stopwords
-from proinfo import SING,PLUR,PRONOUN_LIST,NUMBER_DICT,ANIMATE_DICT,ANIMATE,NONANIMATE,PERSON_DICT,GENDER_DICT,M,F,N
-from npfeats import quick_check_logs
+import numpy as np
+from featstore import FEATURE_NAMES
+from lexicon import lexicon
+from proinfo import SING,PLUR,ANIMATE,NONANIMATE,GENDER_DICT,M,F,N
+from proinfo import NUMBER_BITS,ANIMACY_BITS,PRONOUN_SET,PRONOUN_IDS,PRONOUN_MASKS,PRONOUN_AGREEMENT,PRONOUN_AGREEMENT_IN_QUOTES,to_mask
 
-def get_features(df,sent_num,word_num):
+def build_token_index(part):
+    """Index the rows of a part (its columns, as returned by FeatureStore.part) by (sent_num, word_num), so each word lookup
+    is a dictionary hit instead of a scan over the whole part. Build this once per part and pass it around in place of the columns."""
+    tokens = {}
+    for row in zip(*(part[name].tolist() for name in FEATURE_NAMES)):
+        tokens[(row[2],row[3])] = row
+    return tokens
+
+def build_quote_counts(part):
+    """Count the quotes before every word of a part, sentence by sentence, so whether a word is inside quotes is a single lookup.
+    Build this once per part, along with the token index.
+    Returns:
+      A dictionary from sent_num to an array whose kth value is the number of " characters in words 0 to k-1 of the sentence
+    """
+    counts = np.char.count(np.asarray(part['word'],dtype=str),'"')
+    sent_nums = np.asarray(part['sent_num'])
+    
+    #Sentences are contiguous, so each one starts where the sentence number changes
+    starts = np.flatnonzero(np.diff(sent_nums)) + 1
+    quoteCounts = {}
+    for start,end in zip(np.r_[0,starts],np.r_[starts,len(sent_nums)]):
+        quoteCounts[int(sent_nums[start])] = np.concatenate(([0],np.cumsum(counts[start:end])))
+    return quoteCounts
+
+def get_features(tokens,sent_num,word_num):
     """Get the list of features for this specific row in the data
     Returns a list of features:
         0 = doc_id
@@ -21,148 +45,109 @@ def get_features(df,sent_num,word_num):
         11 = ne
         12 = corefs
     """
-    return df[(df['sent_num'] == sent_num) &
-              (df['word_num'] == word_num)].get_values()[0]
+    return tokens[(sent_num,word_num)]
 
-def build_word_span(df,sent_num,word_span,lowerize=True):
-    """Given the identifiers, get the real words that make up this mention in a single string separated by spaces. Default is to lowercase it, but sometimes that's no good."""
+def build_word_span(tokens,sent_num,start,end,lowerize=True):
+    """Given the identifiers, get the real words that make up this mention (words start to end) in a single string separated by spaces. Default is to lowercase it, but sometimes that's no good."""
     wordList = []
-    for word_num in word_span.split('_'):
-        wordList.append(get_features(df,sent_num,int(word_num))[4])
+    for word_num in range(start,end+1):
+        wordList.append(get_features(tokens,sent_num,word_num)[4])
     
     if lowerize:
         return ' '.join(wordList).lower()
     else:
         return ' '.join(wordList)
     
-def find_sisters(t,target):
-    """Find the syntactic sisters of the given phrase in the given tree.
-    Goes through the subtrees of the tree, adding its children to a list. If it finds a subtree whose leaves match the target,
-    we assume that is the constituent of our target. Then we can return the list of sisters. If it doesn't find the subtree
-    on one level, it will clear the sister-list and try again."""
-    
-    sisters = []
-    targetFound = 0
-    for subtree in t.subtrees():
-        sisters.append(subtree.label())
-        for child in subtree:
-            if type(child) == Tree:
-                leaves = ' '.join(child.leaves()).lower()
-            else:
-                leaves = child.lower()
-            if leaves == target:
-                targetFound = 1
-            sisters.append(leaves)
-        if targetFound:
-            break
-        else:
-            sisters = []
-    
-    return sisters
-    
-def find_prior_appositives(df,mention,tree):
-    """Find any mentions that were appositives of the given mention (but only before the mention, not after)"""
-    
-    sent_num,word_span = mention
-    
-    #First word in our original mention
-    begin = int(word_span.split('_')[0])
-    
-    #no prior appositives if this is the 1st or 2nd word in the sentence
-    if begin < 2:
-        return None
-    
-    #Build the target from the words for the mention, and find its sisters in the syntactic tree
-    target = build_word_span(df,sent_num,word_span)
-    sisters = find_sisters(Tree.fromstring(tree),target)
+def find_appositives(t):
+    """Find every appositive in the given sentence tree, in one walk over its constituents.
+    An appositive is the first NP in a list of sisters of [NP,",",NP] with no conjunction in the list, and it's matched up
+    with each later sister that has a comma somewhere before it (but only before the mention, not after).
+    The appositive's span is taken to end just before the comma that's right before the later sister.
+    Returns:
+      A list of ((start, end), (start, end)) pairs: the appositive's span, then the span of the sister it's an appositive of
+    """
     
-    #not the cases we're looking for
-    if len(sisters) < 1 or sisters[0] != "NP":
-        return None
+    #Group the constituents by their parent. Only NP parents are the cases we're looking for
+    sisterDict = {}
+    for span,parent in t.parents.items():
+        if parent.label() == 'NP':
+            sisterDict.setdefault(id(parent),[]).append(span)
+    
+    pairs = []
+    for sisters in sisterDict.values():
+        sisters.sort()
+        texts = [' '.join(t.spans[span].leaves()).lower() for span in sisters]
+        if any(text in ('and','but','or') for text in texts):
+            continue
         
-    #Only accept an appositive if it's the first NP in a list of sisters of [NP,",",NP] with  no conjunction in the list
-    conjFound = 0
-    priorComma = 0
-    preTarget = 1
-    appos = ''
-    for sister in sisters[1:]:
-        if sister == target:
-            if (appos == '' or not priorComma):
-                appos = ''
-                break
-            else:
-                preTarget = 0
-        elif sister == ',':
-            priorComma = 1
-        elif sister in ('and','but','or'):
-            appos = ''
-            break
-        elif appos == '' and preTarget:
-            appos = sister # restricing to one appositive
+        appos = None
+        priorComma = 0
+        for span,text in zip(sisters,texts):
             
-    if appos == '':
-        return None
-    
-    appos_span = ''
-    if df.loc[(df['sent_num'] == sent_num) & (df['word_num'] == (begin-1-len(appos.split()))),'corefs'].get_values()[0] == '-': #only want appositives if they're actually mentions
-        return None
-    elif df.loc[(df['sent_num'] == sent_num) & (df['word_num'] == (begin-2)),'corefs'].get_values()[0] == '-': #and the entire span needs to be a mention
-        return None
-        
-    #Build the span to match it to the mention format and send it packing
-    for i in range(begin-1-len(appos.split()),begin-1):
-        appos_span += str(i)+'_'
-    return (sent_num,appos_span.strip('_'))
-    
-def acro_info(df,mention):
+            #no prior appositives if this is the 1st or 2nd word in the sentence
+            if appos is not None and priorComma and span[0] >= 2:
+                length = appos[1] - appos[0] + 1
+                pairs.append(((span[0]-1-length,span[0]-2),span))
+            if text == ',':
+                priorComma = 1
+            elif appos is None:
+                appos = span # restricing to one appositive
+    
+    return pairs
+    
+def build_appositives(clusters,mentions,trees,filename,part_num):
+    """Find the appositive of each mention that has one, walking the tree of each sentence with mentions just once.
+    We only want appositives if they're actually mentions (the entire span), so they're checked against the mentions' spans.
+    Returns:
+      A dictionary from a mention's id to the id of its appositive
+    """
+    spanDict = {}
+    for i,mention in enumerate(mentions):
+        spanDict.setdefault(mention.sent_num,{})[(mention.start,mention.end)] = i
+    
+    appositives = {}
+    for sent_num,spans in spanDict.items():
+        for apposSpan,span in find_appositives(trees[(filename,str(part_num),str(sent_num))]):
+            if span in spans and apposSpan in spans:
+                appositives[spans[span]] = spans[apposSpan]
+    return appositives
+    
+def acro_info(tokens,mention):
     """Returns the acronym form of this mention (if it can be turned into an acronym)"""
-    sent_num,word_span = mention
+    sent_num,start,end = mention
     
     #Only find the acronym for non-acronym mentions if they're all proper nouns
-    for word_num in word_span.split('_'):
-        pos = get_features(df,sent_num,int(word_num))[5]
+    for word_num in range(start,end+1):
+        pos = get_features(tokens,sent_num,word_num)[5]
         if pos != 'NNP':
             return ''
         
-    start = build_word_span(df,sent_num,word_span,lowerize=False)
+    words = build_word_span(tokens,sent_num,start,end,lowerize=False)
     
     #Acronyms have to be all-uppercase and greater than 2 characters
-    if start.isupper() and len(start) > 2:
-        return start
+    if words.isupper() and len(words) > 2:
+        return words
     
     #Acronymables have to be in title case and greater than 2 words
-    elif start.istitle() and len(start.split()) > 2:
+    elif words.istitle() and len(words.split()) > 2:
         acro = ''
-        for word in start.split():
+        for word in words.split():
             acro += word[0]
         return acro
     else:
         return ''
         
-def find_head(t,target):
-    """Find the head of the target phrase in the given sentence tree.
-    First, find the appropriate NP tree for the target(if possible).
+def find_head(t,start,end):
+    """Find the head of the phrase spanning words start to end in the given sentence tree.
+    First, find the appropriate NP tree for the target (if possible) in the tree's span index.
     Then, find the highest NN, NNP, or NNS, and if there are multiple at the same level,
     take the furthest-right one. Search the NPs breadth-first, left-to-right.
     We also want to return the POS in order to determine if the target is singular or plural
     when pronoun-matching."""
     
-    
-    targetFound = 0
-    for subtree in t.subtrees():
-        for child in subtree:
-            if type(child) == Tree:
-                leaves = ' '.join(child.leaves()).lower()
-            else:
-                leaves = child.lower()
-            if leaves == target:
-                targetFound = 1
-                targetTree = child
-        if targetFound:
-            break
-    
-    if targetFound == 0:
+    if (start,end) not in t.spans:
         return ('','')
+    targetTree = t.spans[(start,end)]
             
     if targetTree.label() != 'NP':
         return ('','')
@@ -172,11 +157,12 @@ def find_head(t,target):
     while targetTree != '':
         looking = 1
         nextSubtree = ''
+        #Children are either subtrees or words (strings)
         for child in targetTree:
-            if type(child) == Tree and child.label() == 'NP' and looking:
+            if not isinstance(child,str) and child.label() == 'NP' and looking:
                 nextSubtree = child
                 looking = 0
-            if type(child) == Tree and child.label() in ('NN','NNP','NNS'):
+            if not isinstance(child,str) and child.label() in ('NN','NNP','NNS'):
                 bestHead = child.leaves()[0]
                 pos = child.label()
         if bestHead != '':
@@ -185,49 +171,43 @@ def find_head(t,target):
         
     return (bestHead,pos)
 
-def find_mention_head(df,mention,tree):
-    """Find the head word and its POS of the given mention using the syntax tree"""
-    t = Tree.fromstring(tree)
-    
-    sent_num,word_span = mention
+def find_mention_head(tokens,mention,t):
+    """Find the head word and its POS of the given mention using the parsed syntax tree"""
     
-    target = build_word_span(df,sent_num,word_span)
+    sent_num,start,end = mention
     
     #With just one word, it's its own head
-    if len(target.split(' ')) == 1:
-        return (target,get_features(df,sent_num,int(word_span))[5])
+    if start == end:
+        return (build_word_span(tokens,sent_num,start,end),get_features(tokens,sent_num,start)[5])
         
-    head,pos = find_head(t,target)
+    head,pos = find_head(t,start,end)
     
     return (head.lower(),pos)
     
-def build_indices(groupings):
-    """Build indexed, ordered lists of mentions partitioned by sentence, as well as a second partitioned by grouping"""
+def build_indices(clusters):
+    """Build ordered lists of mention ids partitioned by sentence, with the mentions of each sentence in text order"""
     
     sentenceDict = {}
-    index = {}
     
-    for i in range(len(groupings)):
-        grouping = groupings[i]
-        for sent_num,word_span in grouping:
+    for root in clusters.roots():
+        for i in clusters.members(root):
+            sent_num = clusters.mentions[i][0]
             if sent_num in sentenceDict:
-                sentenceDict[sent_num].append((sent_num,word_span))
+                sentenceDict[sent_num].append(i)
             else:
-                sentenceDict[sent_num] = [(sent_num,word_span)]
-            index[(sent_num,word_span)] = i
+                sentenceDict[sent_num] = [i]
             
     for sent in sentenceDict:
-        sentenceDict[sent].sort(key=(lambda x: int(x[1].split('_')[0])))
+        sentenceDict[sent].sort(key=(lambda i: clusters.mentions[i][1]))
         
-    return (sentenceDict,index)
+    return sentenceDict
     
-def find_number(mention,df,sent_tree):
-    """Find the number (singular or plural or both) for a mention."""
+def find_number(ner,pos):
+    """Find the number (singular or plural or both) for a mention, from the NER tag of its first word and the POS of its head."""
     
     numberSet = set()
     
     #first check the NER tag
-    ner = get_features(df,mention[0],int(mention[1].split('_')[0]))[11].strip('()*')
     if ner in ('LOC','PERSON','GPE','FAC'):
         numberSet.add(SING)
         return numberSet
@@ -237,7 +217,6 @@ def find_number(mention,df,sent_tree):
         return numberSet
     
     #then check POS of the head
-    pos = find_mention_head(df,mention,sent_tree)[1]
     if pos == 'NNS':
         numberSet.add(PLUR)
     else:
@@ -246,31 +225,31 @@ def find_number(mention,df,sent_tree):
             
     return numberSet
             
-def find_animacy(mention,df):
-    """Find the animacy (animate or nonanimate) for a mention."""
+def find_animacy(ner):
+    """Find the animacy (animate or nonanimate) for a mention, from the NER tag of its first word."""
 
-    ner = get_features(df,mention[0],int(mention[1].split('_')[0]))[11].strip('()*')
     if ner == 'PERSON':
         return ANIMATE
     else:
         return NONANIMATE
     
-def check_property_match(pronoun,mention,df,sentTree,g_log):
-    """Check if the properties of the pronoun we're trying to group match those of the mention we're trying to group it with."""
+def check_property_match(pronoun,mention,g_log):
+    """Check if the properties of the pronoun we're trying to group match those of the mention (a Mention) we're trying to group it with."""
+    
+    shared = PRONOUN_MASKS[pronoun] & mention.features
     
     #Check if number matches
-    mentionNum = find_number(mention,df,sentTree)
-    if len(mentionNum) > 0 and len(set(NUMBER_DICT[pronoun]).intersection(mentionNum)) == 0:
+    if mention.features & NUMBER_BITS and not shared & NUMBER_BITS:
         return False
     
     #Check if animacy matches    
-    if find_animacy(mention,df) not in ANIMATE_DICT[pronoun]:
+    if not shared & ANIMACY_BITS:
         return False
     
     #person is only for pronoun-pronoun
     '''
-    #Check if gender matches - unused, did not improve
-    gender = quick_check_logs(build_word_span(df,mention[0],mention[1]),g_log)[0]
+    #Check if gender matches - unused, did not improve (needs npfeats.check_gender, which would have to be imported)
+    gender = check_gender(mention.text,g_log)
     if gender == 'female' and F not in GENDER_DICT[pronoun]:
         return False
     elif gender == 'male' and M not in GENDER_DICT[pronoun]:
@@ -282,291 +261,239 @@ def check_property_match(pronoun,mention,df,sentTree,g_log):
     return True
     
 def check_property_match_pro(a,b,oneInQuotes):
-    """Check whether two pronouns match properties."""
+    """Check whether two pronouns match properties, using the agreement tables compiled in proinfo."""
 
     #Check person; however, if one is in quotes, then we don't check person because it is most likely different speakers, so different-person pronouns can actually match
-    #This is the only scenario where two pronouns that don't match in person could still match, or the same pronoun could be for different speakers,
-    #so we put it before the string match.
-    if (not oneInQuotes) and PERSON_DICT[a] != PERSON_DICT[b]:
-        return False
-    
-    #if they're the same they're the same, what are you gonna do
-    if a == b:
-        return True
-        
-    #Check number agreement
-    if len(set(NUMBER_DICT[a]).intersection(set(NUMBER_DICT[b]))) == 0:
-        return False
-    
-    #Check animacy agreement
-    if len(set(ANIMATE_DICT[a]).intersection(set(ANIMATE_DICT[b]))) == 0:
-        return False
-        
-    #Check gender agreement
-    if len(set(GENDER_DICT[a]).intersection(set(GENDER_DICT[b]))) == 0:
-        return False
-        
-    return True
+    #If they're the same they're the same; otherwise they have to agree in number, animacy and gender.
+    if oneInQuotes:
+        return bool(PRONOUN_AGREEMENT_IN_QUOTES[PRONOUN_IDS[a],PRONOUN_IDS[b]])
+    return bool(PRONOUN_AGREEMENT[PRONOUN_IDS[a],PRONOUN_IDS[b]])
     
-def is_in_quotes(df,sent_num,word_span):
-    """Check if a word span is in quotes by counting the number of quotes before it in the sentence. If an odd number, that means an unclosed quote."""
+def is_in_quotes(quoteCounts,sent_num,firstWord):
+    """Check if a word span starting at firstWord is in quotes from the number of quotes before it in the sentence (see build_quote_counts). If an odd number, that means an unclosed quote."""
     
-    firstWord = int(word_span.split('_')[0])
-    
-    #Nothing before the first word in a sentence
-    if firstWord == 0:
-        return False
-        
-    #Build the sentence prior to the given span and count its quotes
-    sentSpan = ''
-    for i in range(firstWord):
-        sentSpan += str(i) + '_'
-    sentSpan = sentSpan.strip('_')
-    sentPart = build_word_span(df,sent_num,sentSpan)
-    quoteCount = sentPart.count('"')
-    
-    #Even number of qoutes = none open when our word_span is hit
-    if quoteCount % 2 == 0:
-        return False
-        
-    return True
+    #Even number of qoutes = none open when our word span is hit
+    return quoteCounts[sent_num][firstWord] % 2 == 1
+
+class Mention(object):
+    """All the attributes of a mention that the modules need, worked out once per part instead of once per comparison.
+    Attributes:
+      sent_num, start, end - The mention's identifiers, as they appear in the groupings: its sentence, and the word numbers of its first and last words
+      text - The words of the mention, lowercased and separated by spaces
+      head - The head word (lowercased), or '' if no head was found
+      acronym - The acronym form of the mention (see acro_info), or '' if it hasn't got one
+      features - The number (SING/PLUR) and animacy (ANIMATE or NONANIMATE) as a proinfo bitmask, for checking agreement with a pronoun
+      is_pronoun - Whether the text is in PRONOUN_LIST
+      in_quotes - Whether the mention is inside an unclosed quote in its sentence
+    """
+    __slots__ = ('sent_num','start','end','text','head','acronym','features','is_pronoun','in_quotes')
+
+    def __init__(self,tokens,quoteCounts,mention,tree):
+        self.sent_num,self.start,self.end = mention
+        self.text = build_word_span(tokens,self.sent_num,self.start,self.end)
+        self.head,pos = find_mention_head(tokens,mention,tree)
+        self.acronym = acro_info(tokens,mention)
+        ner = get_features(tokens,self.sent_num,self.start)[11].strip('()*')
+        self.features = to_mask(list(find_number(ner,pos)) + [find_animacy(ner)])
+        self.is_pronoun = self.text in PRONOUN_SET
+        self.in_quotes = is_in_quotes(quoteCounts,self.sent_num,self.start)
+
+def mention_ranks(spans,tokens):
+    """Rank the mentions of a part (in chain order, as from FeatureStore.part_mentions) for breaking ties between mentions that
+    start at the same word (see MentionClusters). This is the order module1 has always put such clusters in: a mention ranks
+    where its words first appear in chain order, except for a pronoun, which ranks where it appears itself.
+    So in [[John] 's mother], John comes first only if it (or another "John") was listed before "John 's mother".
+    Returns:
+      A list of the ranks, one per mention
+    """
+    firstSeen = {}
+    ranks = []
+    for i,(sent_num,start,end) in enumerate(spans.tolist()):
+        text = build_word_span(tokens,sent_num,start,end)
+        if text in PRONOUN_SET:
+            ranks.append(i)
+        else:
+            ranks.append(firstSeen.setdefault(text,i))
+    return ranks
 
-def module1(groupings,df,trees,filename,part_num):
+def build_mentions(clusters,tokens,quoteCounts,trees,filename,part_num):
+    """Build a Mention for every mention in the clusters of this filename and part number.
+    Returns a list of Mentions, indexed by mention id"""
+    mentions = []
+    for mention in clusters.mentions:
+        mentions.append(Mention(tokens,quoteCounts,mention,trees[(filename,str(part_num),str(mention[0]))]))
+    return mentions
+
+def module1(clusters,mentions,tokens,trees,filename,part_num):
     """First module: Exact match of words (except pronouns)"""
     matchDict = {}
-    newGroupings = []
-    proCount = 0
-    
-    for grouping in groupings:
-        
-        mention = grouping[0]
-        words = build_word_span(df,mention[0],mention[1])
-        
+
+    #Clusters come in text order, so each one is merged into the earliest cluster with the same words
+    for root in clusters.roots():
+
         #do NOT want to deal with pronouns this pass
-        if words in PRONOUN_LIST: 
-            matchDict["pro" + str(proCount)] = [mention]
-            proCount += 1
-        
+        if mentions[root].is_pronoun:
+            continue
+
+        words = mentions[root].text
+        if words in matchDict:
+            clusters.union(matchDict[words],root)
         else:
-            if words in matchDict:
-                matchDict[words].append(mention)
-            else:
-                matchDict[words] = [mention]
-    
-    #For each grouping, sort by sentence number primarily, and word numbers secondarily
-    for key in matchDict:
-        mentionList = matchDict[key]
-        mentionList.sort(key=(lambda x: int(x[1].split('_')[0])))
-        mentionList.sort(key=(lambda x: x[0]))
-        newGroupings.append(mentionList)
-    
-    
-    #sort groupings of mentions by text appearance order
-    newGroupings.sort(key=(lambda x: int(x[0][1].split('_')[0])))
-    newGroupings.sort(key=(lambda x: x[0][0]))
-    
-    return newGroupings
-    
-    
+            matchDict[words] = root
 
-def module2(groupings,df,trees,filename,part_num):
+def module2(clusters,mentions,tokens,trees,filename,part_num):
     """Second module: Appositives and acronyms"""
     
-    newGroupingsDict = {}
-    newGroupings = []
+    #The appositive of each mention, if it has one
+    appositives = build_appositives(clusters,mentions,trees,filename,part_num)
     
+    #The clusters that have a mention with each acronym form, and the ones that have a single-word mention with it.
+    #They're filled in as each cluster is seen (or merged), so finding an acronym match is a lookup instead of a search through the earlier clusters.
+    acroIndex = {}
+    singleAcroIndex = {}
     
-    for i in range(len(groupings)):
-        unMerged = 1
-        mention = groupings[i][0]
+    for i in clusters.roots():
         
-        #Find appositives, if any
-        appositive = find_prior_appositives(df,mention,trees[(filename,str(part_num),str(mention[0]))])
+        #The acronym form of every mention in this cluster
+        acronyms = [(member,mentions[member].acronym) for member in clusters.members(i)]
+        acronymForm = acronyms[0][1]
         
-        #Find the acronym form, if any
-        acronymForm = acro_info(df,mention)
+        #Only clusters seen already can match (they're earlier in the text, since the clusters are in text order), and we want the earliest one that does
+        candidates = []
         
-        #Search through the mentions already seen and grouped (should be earlier in the sentence too, since we sorted them at the end of module 1)
-        for key,cluster in newGroupingsDict.items():
-            
-            #Check each mention in each cluster individually. If it matches the appositive to our current mention, or matches as acronym, then merge them up.
-            for antecedent in cluster:
-                if appositive == antecedent:
-                    unMerged = 0
-                    rightCluster = key
-                    break
-                if acronymForm != '' and acronymForm == acro_info(df,antecedent) and ('_' not in mention[1] or '_' not in antecedent[1]):
-                    unMerged = 0
-                    rightCluster = key
-                    break
-            if not unMerged:
-                break
-                    
-        #Either add this grouping to an existing grouping, or start a new one if it hasn't found a match
-        if unMerged:
-            newGroupingsDict[i] = groupings[i]
+        #The appositive comes before our mention, so the cluster it's in has already been seen
+        if i in appositives:
+            candidates.append(clusters.find(appositives[i]))
+        
+        #A multi-word mention can only match an acronym that's a single word
+        if acronymForm != '':
+            if mentions[i].start == mentions[i].end:
+                matches = acroIndex.get(acronymForm)
+            else:
+                matches = singleAcroIndex.get(acronymForm)
+            if matches:
+                candidates.append(min(matches))
+        
+        #Either add this cluster to an existing cluster, or keep it as a new one if it hasn't found a match
+        if candidates == []:
+            rightCluster = i
         else:
-            newGroupingsDict[rightCluster].extend(groupings[i])
-            
-    #Rewrite all the new groupings and return
-    keyList = list(newGroupingsDict.keys())
-    keyList.sort()
-    for key in keyList:
-        newGroupings.append(newGroupingsDict[key])
-    
-    return newGroupings
+            rightCluster = min(candidates)
+            clusters.union(rightCluster,i)
+        
+        for member,acro in acronyms:
+            if acro != '':
+                acroIndex.setdefault(acro,set()).add(rightCluster)
+                if mentions[member].start == mentions[member].end:
+                    singleAcroIndex.setdefault(acro,set()).add(rightCluster)
     
-def module3(groupings,df,trees,filename,part_num):
+def module3(clusters,mentions,tokens,trees,filename,part_num):
     """Third module: Head matching"""
     
-    newGroupingsDict = {}
-    newGroupings = []
-    stopwordsList = stopwords.words('english')
+    stopwordsList = lexicon('stopwords')
     
-    for i in range(len(groupings)):
-        unMerged = 1
-        
-        #We only want to match up the first (earliest-in-text) mention for each group
-        firstMention = groupings[i][0]
-        
-        #Ignore pronouns
-        if build_word_span(df,firstMention[0],firstMention[1]) in PRONOUN_LIST:
-            newGroupingsDict[i] = groupings[i]
-            continue
+    #The non-stop-words of each cluster seen so far, and the clusters that have a mention with each head word.
+    #Both are kept up to date as clusters are merged, so a cluster is only compared with the ones that share its head.
+    contentDict = {}
+    headIndex = {}
+    
+    for i in clusters.roots():
         
-        #Find all the non-stop-words in this grouping's mentions
+        #Find all the non-stop-words and heads in this grouping's mentions
         contentList = set()
-        for mention in groupings[i]:
-            words = build_word_span(df,mention[0],mention[1])
-            for word in words.split(' '):
+        heads = set()
+        for mention in clusters.members(i):
+            heads.add(mentions[mention].head)
+            for word in mentions[mention].text.split(' '):
                 if word not in stopwordsList:
                     contentList.add(word)
         
-        #If it doesn't have anything but stopwords it's not going to be helpful
-        if len(contentList) == 0:
-            newGroupingsDict[i] = groupings[i]
-            continue
-        
-        #Find this mention's headword, if possible
-        head = find_mention_head(df,firstMention,trees[(filename,str(part_num),str(firstMention[0]))])[0]
-        if head == '':
-            newGroupingsDict[i] = groupings[i]
-            continue
+        #We only want to match up the first (earliest-in-text) mention for each group, which is the cluster's root.
+        #Ignore pronouns, and clusters with nothing but stopwords (they're not going to be helpful) or without a headword
+        head = mentions[i].head
+        rightCluster = None
+        if not mentions[i].is_pronoun and len(contentList) > 0 and head != '':
+            
+            #Of the earlier clusters with a matching headword, merge with the first one that has all of our non-stop-words
+            for key in sorted(headIndex.get(head,())):
+                if contentList.issubset(contentDict[key]):
+                    rightCluster = key
+                    break
         
-        #For each cluster, add all of its non-stop-words to a set, and try to find a headword that matches the headword for our current mention.
-        #If both conditions are satisfied, merge them together.
-        for key,cluster in newGroupingsDict.items():
-            foundGoodHead = 0
-            antContent = set()
-            for antecedent in cluster:
-                if head == find_mention_head(df,antecedent,trees[(filename,str(part_num),str(antecedent[0]))])[0]:
-                    foundGoodHead = 1
-                words = build_word_span(df,antecedent[0],antecedent[1])
-                for word in words.split(' '):
-                    if word not in stopwordsList:
-                        antContent.add(word)
-            if foundGoodHead and contentList.issubset(antContent):
-                unMerged = 0
-                rightCluster = key
-                break
-        if unMerged:
-            newGroupingsDict[i] = groupings[i]
+        if rightCluster is None:
+            rightCluster = i
+            contentDict[i] = contentList
         else:
-            newGroupingsDict[rightCluster].extend(groupings[i])
-    
-    #Rewrite all the new groupings and return
-    keyList = list(newGroupingsDict.keys())
-    keyList.sort()
-    for key in keyList:
-        newGroupings.append(newGroupingsDict[key])
-    
-    return newGroupings
+            clusters.union(rightCluster,i)
+            contentDict[rightCluster].update(contentList)
+        
+        for mentionHead in heads:
+            if mentionHead != '':
+                headIndex.setdefault(mentionHead,set()).add(rightCluster)
     
-def module7(groupings,df,trees,filename,part_num,g_log):
+def module7(clusters,mentions,tokens,trees,filename,part_num,g_log):
     """Fourth module: Pronoun matching"""
-    
-    #Need indices because we're now going by strict sentence order, instead of sentence order within grouping order
-    sentences,index = build_indices(groupings)
-    
-    for i in range(len(groupings)):
-        
-        sent_num,word_span = groupings[i][0]
-        pronoun = build_word_span(df,sent_num,word_span)
-        
+
+    #Need sentence lists because we're now going by strict sentence order, instead of sentence order within grouping order
+    sentences = build_indices(clusters)
+
+    for i in clusters.roots():
+
+        sent_num = clusters.mentions[i][0]
+        proMention = mentions[i]
+        pronoun = proMention.text
+
         #now we're ONLY interested in pronouns
-        if pronoun not in PRONOUN_LIST:
+        if not proMention.is_pronoun:
             continue
-        
+
         #we only want to check this sentence (R->L) and the previous (L->R)
         currSent = sentences[sent_num]
-        currSent = currSent[:currSent.index((sent_num,word_span))]
+        currSent = currSent[:currSent.index(i)]
         currSent.reverse()
-        
+
         #See if the pronoun is in quotes (can matter when matching pronoun-pronoun)
-        inQuotes = is_in_quotes(df,sent_num,word_span)
-        
-        currSentTree = trees[filename,str(part_num),str(sent_num)]
+        inQuotes = proMention.in_quotes
+
         matched = 0
-        
+
         #Compare pronoun to all the mentions in the sentence before it
         for mention in currSent:
-            
-            text = build_word_span(df,mention[0],mention[1])
-            
+
+            text = mentions[mention].text
+
             #Pronoun-pronoun
-            if text in PRONOUN_LIST:
-                textInQuotes = is_in_quotes(df,mention[0],mention[1])
+            if mentions[mention].is_pronoun:
+                textInQuotes = mentions[mention].in_quotes
                 if not check_property_match_pro(pronoun,text,inQuotes or textInQuotes):
                     continue
-            
+
             #Pronoun-noun
-            elif not check_property_match(pronoun,mention,df,currSentTree,g_log):
+            elif not check_property_match(pronoun,mentions[mention],g_log):
                 continue
-            
+
             #Match these up
             matched = 1
-            rightCluster = index[mention]
-            for proclust in groupings[i]:
-                index[proclust] = rightCluster
+            clusters.union(mention,i)
             break
-        
+
         #done with this cluster if we matched it, or this is the first sentence
         if matched or sent_num == 0 or (sent_num - 1) not in sentences:
             continue
-            
+
         #otherwise we're looking at the previous sentence (in its original order), IF it has any mentions
         prevSent = sentences[sent_num-1]
-        prevSentTree = trees[filename,str(part_num),str(sent_num-1)]
-        
+
         #Use same method as current sentence
         for mention in prevSent:
-            text = build_word_span(df,mention[0],mention[1])
-            if text in PRONOUN_LIST:
-                textInQuotes = is_in_quotes(df,mention[0],mention[1])
+            text = mentions[mention].text
+            if mentions[mention].is_pronoun:
+                textInQuotes = mentions[mention].in_quotes
                 if not check_property_match_pro(pronoun,text,inQuotes or textInQuotes):
                     continue
-                
-            elif not check_property_match(pronoun,mention,df,prevSentTree,g_log):
+
+            elif not check_property_match(pronoun,mentions[mention],g_log):
                 continue
-                
-            rightCluster = index[mention]
-            for proclust in groupings[i]:
-                index[proclust] = rightCluster
+
+            clusters.union(mention,i)
             break
-    
-    #everything should be situated at this point; just rebuild the groupings from the index
-    
-    #Make an index in the list for each new list
-    newGroupings = []        
-    for i in range(max(index.values())+1):
-        newGroupings.append([])
-    
-    #Add each mention to the appropriate grouping
-    for mention in index:
-        newGroupings[index[mention]].append(mention)
-    
-    #Collapse the list of lists
-    while [] in newGroupings:
-        newGroupings.remove([])
-        
-    return newGroupings
\ No newline at end of file
@@ -0,0 +1,130 @@
+"""Instrumentation for main.py --stats: where the time goes when resolving each part, and what each sieve module does.
+
+Every part gives one record per step, as a dictionary:
+    doc, part, genre  - The document, part number, and genre (the first part of the document name, e.g. bc or nw)
+    step              - 'setup' (reading the part and indexing its words), 'mentions' (building its Mentions), a sieve module's name,
+                        'output' (writing it out), or 'part' for the whole part
+    seconds           - Wall time spent on the step
+    mentions          - The number of mentions in the part
+    clusters_in       - The number of clusters before the step
+    clusters_out      - The number of clusters after it
+    merges            - How many clusters the step merged into others
+The 'part' record also has the hits and misses of the caches used while resolving the part:
+    tree_hits, tree_misses  - Syntax trees found in the TreeCache, and trees that had to be built
+
+Records are written one per line as JSON (write_records), and summarized by genre and step (summarize). To summarize a
+file written by an earlier run, use
+    python stats.py STATS
+"""
+import argparse
+import json
+import time
+from collections import OrderedDict
+
+#The cache counters kept in the 'part' records, as (name, hits key, misses key)
+CACHES = [('trees','tree_hits','tree_misses')]
+
+def genre(filename):
+    """The genre of a document, e.g. nw for nw/wsj/23/wsj_2300"""
+    return filename.split('/')[0]
+
+class PartStats(object):
+    """Records the steps of resolving one part as they finish (see the module docstring for what's in each record)"""
+
+    def __init__(self,filename,part_num):
+        """Start timing a part. Set mentions once the part's mentions have been read."""
+        self.filename = filename
+        self.part_num = part_num
+        self.mentions = 0
+        self.records = []
+        self.started = time.perf_counter()
+        self.last = self.started
+
+    def record(self,step,seconds,clustersIn,clustersOut):
+        record = OrderedDict([('doc',self.filename),('part',self.part_num),('genre',genre(self.filename)),('step',step),
+                              ('seconds',round(seconds,6)),('mentions',self.mentions),('clusters_in',clustersIn),
+                              ('clusters_out',clustersOut),('merges',clustersIn-clustersOut)])
+        self.records.append(record)
+        return record
+
+    def step(self,step,clustersIn,clustersOut):
+        """Record a step that just finished, timed from the end of the last one"""
+        now = time.perf_counter()
+        self.record(step,now - self.last,clustersIn,clustersOut)
+        self.last = now
+
+    def finish(self,clusters,trees):
+        """Record the whole part, ending with clusters clusters, along with the cache counters of its TreeCache.
+        Returns:
+          All the part's records
+        """
+        record = self.record('part',time.perf_counter() - self.started,self.mentions,clusters)
+        record['tree_hits'] = trees.hits
+        record['tree_misses'] = trees.misses
+        return self.records
+
+def write_records(records,path):
+    """Write records to path as JSON lines"""
+    with open(path,'w',encoding='utf8') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+def read_records(path):
+    """Read the records written by write_records"""
+    with open(path,encoding='utf8') as f:
+        return [json.loads(line,object_pairs_hook=OrderedDict) for line in f if line.strip()]
+
+def hit_rate(hits,misses):
+    if hits + misses == 0:
+        return '-'
+    return format(100.0*hits/(hits+misses),'.1f') + '%'
+
+def summarize(records):
+    """Make a table of the total time, share of the genre's time, and merges of every step in each genre.
+    The 'part' row of each genre also has the hit rates of the caches.
+    Returns:
+      The table as a string, one line per genre and step
+    """
+    #Steps are listed in the order they ran, genres in the order they came
+    totals = OrderedDict()
+    for record in records:
+        key = (record['genre'],record['step'])
+        if key not in totals:
+            totals[key] = {'parts':0,'seconds':0.0,'merges':0,'mentions':0,'hits':[0]*len(CACHES),'misses':[0]*len(CACHES)}
+        total = totals[key]
+        total['parts'] += 1
+        total['seconds'] += record['seconds']
+        total['merges'] += record['merges']
+        total['mentions'] += record['mentions']
+        if record['step'] == 'part':
+            for i,(name,hits,misses) in enumerate(CACHES):
+                total['hits'][i] += record[hits]
+                total['misses'][i] += record[misses]
+
+    header = ['genre','step','parts','mentions','seconds','share','ms/part','merges'] + [name + ' hits' for name,hits,misses in CACHES]
+    rows = []
+    for (genreName,step),total in totals.items():
+        partTotal = totals.get((genreName,'part'),total)
+        share = 100.0*total['seconds']/partTotal['seconds'] if partTotal['seconds'] else 0.0
+        row = [genreName,step,str(total['parts']),str(total['mentions']),format(total['seconds'],'.3f'),format(share,'.1f') + '%',
+               format(1000.0*total['seconds']/total['parts'],'.2f'),str(total['merges'])]
+        if step == 'part':
+            row += [hit_rate(total['hits'][i],total['misses'][i]) for i in range(len(CACHES))]
+        else:
+            row += ['']*len(CACHES)
+        rows.append(row)
+
+    widths = [max(len(row[i]) for row in [header] + rows) for i in range(len(header))]
+    lines = []
+    for row in [header] + rows:
+        #Names are left-aligned, numbers right-aligned
+        cells = [cell.ljust(widths[i]) if i < 2 else cell.rjust(widths[i]) for i,cell in enumerate(row)]
+        lines.append('  '.join(cells).rstrip())
+    return '\n'.join(lines)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Summarize the statistics written by main.py --stats')
+    parser.add_argument('stats',help='the JSON lines file written by main.py --stats')
+    args = parser.parse_args()
+
+    print(summarize(read_records(args.stats)))
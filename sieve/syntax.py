@@ -0,0 +1,100 @@
+from collections import OrderedDict
+from string import punctuation
+from nltk.tree import Tree
+
+#How many parsed sentence trees to hold at once. Parts are resolved one at a time, so this only needs to cover the sentences of a large part.
+TREE_CACHE_SIZE = 1024
+
+class SentenceTree(object):
+    """A parsed sentence tree along with its span index.
+    Attributes:
+      tree - The nltk Tree of the sentence, whose leaves are its words in order
+      spans - Dictionary from (start, end) word numbers to the constituent covering exactly those words.
+              When a chain of unary constituents share a span (e.g. (NP (NP ...)) or (NP (PRP he))), the highest one is kept.
+              The root isn't indexed, since it isn't anyone's sister.
+      parents - Dictionary from the same (start, end) spans to the parent of that constituent
+    """
+    __slots__ = ('tree','spans','parents')
+
+    def __init__(self,tree,spans,parents):
+        self.tree = tree
+        self.spans = spans
+        self.parents = parents
+
+def build_tree(rows):
+    """Build a sentence's tree and its span index straight from the parse bits of its words, in one pass.
+    Each parse bit is the bracketing around one word with the word replaced by a * (e.g. (TOP(S(NP* or *))),
+    so we push a new constituent for every open bracket, add the word under its POS, and pop one for every close bracket.
+    Punctuation gets the POS 'PUNC', as it always has in our trees.
+    Input:
+      rows - A list of (word, pos, parse_bit) tuples, one per word of the sentence in order
+    Returns:
+      A SentenceTree
+    """
+    spans = {}
+    parents = {}
+    root = None
+
+    #Open constituents, each with the word number it started at
+    stack = []
+
+    for word_num,(word,pos,parse_bit) in enumerate(rows):
+        if word in punctuation:
+            pos = 'PUNC'
+        opening,closing = parse_bit.split('*')
+
+        for label in opening.split('(')[1:]:
+            node = Tree(label.strip(),[])
+            if stack:
+                stack[-1][0].append(node)
+            else:
+                root = node
+            stack.append((node,word_num))
+
+        leaf = Tree(pos,[word])
+        stack[-1][0].append(leaf)
+        spans[(word_num,word_num)] = leaf
+        parents[(word_num,word_num)] = stack[-1][0]
+
+        #Inner constituents close first, so a parent with the same span overwrites them
+        for i in range(closing.count(')')):
+            node,start = stack.pop()
+            if stack:
+                spans[(start,word_num)] = node
+                parents[(start,word_num)] = stack[-1][0]
+
+    return SentenceTree(root,spans,parents)
+
+class TreeCache(object):
+    """Syntax trees (SentenceTree), keyed by (doc_id, part_num, sent_num) just like the parse bits from preprocess.get_parse_bits.
+    A sentence's tree is built the first time it's asked for, and is then reused until it becomes the least recently used tree
+    while the cache is full, at which point it's dropped.
+    hits and misses count the trees that were found in the cache and the ones that had to be built."""
+
+    def __init__(self,sources,maxsize=TREE_CACHE_SIZE):
+        """Inputs:
+          sources - Dictionary of each sentence's (word, pos, parse_bit) rows, as returned by preprocess.get_parse_bits
+          maxsize - The most parsed trees to keep at once
+        """
+        self.sources = sources
+        self.maxsize = maxsize
+        self.parsed = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __getitem__(self,key):
+        """Get the tree for this (doc_id, part_num, sent_num) key, building it if it isn't cached"""
+        if key in self.parsed:
+            self.hits += 1
+            self.parsed.move_to_end(key)
+            return self.parsed[key]
+
+        self.misses += 1
+        tree = build_tree(self.sources[key])
+        self.parsed[key] = tree
+        if len(self.parsed) > self.maxsize:
+            self.parsed.popitem(last=False)
+        return tree
+
+    def __contains__(self,key):
+        return key in self.sources
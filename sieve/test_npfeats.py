@@ -0,0 +1,163 @@
+"""End-to-end tests of npfeats.prefetch_nps against local fake page sources: one in memory, and a fake MediaWiki API server
+for pagestore.WikipediaPages. Run from the sieve directory with
+    python -m unittest test_npfeats
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler,ThreadingHTTPServer
+from urllib.parse import urlparse,parse_qs
+
+import npfeats
+from attrcache import AttributeCache
+from pagestore import Page
+
+SIEVE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+PAGES = [Page('Barack Obama','Barack Obama is an American politician. He served as president, and his wife is Michelle.'),
+         Page('Senate','The Senate is a legislative chamber. It is the upper house.'),
+         Page('Oranges','Oranges are fruits. They are grown in orchards, and they are eaten.')]
+
+class FakePages(object):
+    """A page source (see pagestore) holding PAGES in memory. Lookups of the titles in slow take delay seconds."""
+
+    def __init__(self,slow=(),delay=0):
+        self.pages = {page.title.lower():page for page in PAGES}
+        self.slow = set(slow)
+        self.delay = delay
+        self.lookups = []
+
+    def page(self,query):
+        self.lookups.append(query)
+        if query.lower() in self.slow:
+            time.sleep(self.delay)
+        if query.lower() not in self.pages:
+            raise LookupError(query)
+        return self.pages[query.lower()]
+
+    def summary(self,query):
+        return self.page(query).summary
+
+    def search(self,query):
+        return [page.title for key,page in self.pages.items() if query.lower() in key]
+
+    def prefetch(self,queries):
+        return 0
+
+class LogsTestCase(unittest.TestCase):
+    """Gives each test empty gender and plurality logs"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.log_g = AttributeCache(os.path.join(self.dir,'genders.cache'))
+        self.log_p = AttributeCache(os.path.join(self.dir,'plurality.cache'))
+
+    def tearDown(self):
+        self.log_g.close()
+        self.log_p.close()
+        shutil.rmtree(self.dir)
+
+class PrefetchTest(LogsTestCase):
+
+    def test_fills_logs_once_per_np(self):
+        pages = FakePages()
+        checked,timedOut = npfeats.prefetch_nps(['Barack_Obama','barack  obama','the senate','oranges'],self.log_g,self.log_p,pages,workers=2)
+        self.assertEqual((checked,timedOut),(3,0))
+        self.assertEqual(self.log_g['Barack Obama'],'male')
+        self.assertEqual(self.log_p['oranges'],'plural')
+        for np in ('barack obama','the senate','oranges'):
+            self.assertEqual((self.log_g[np],self.log_p[np]),npfeats.quick_check(np,FakePages()))
+
+        #Everything is cached now, so nothing is looked up again
+        pages.lookups = []
+        self.assertEqual(npfeats.prefetch_nps(['Barack Obama','oranges'],self.log_g,self.log_p,pages),(0,0))
+        self.assertEqual(pages.lookups,[])
+
+    def test_slow_np_times_out(self):
+        pages = FakePages(slow=['senate'],delay=2)
+        start = time.monotonic()
+        checked,timedOut = npfeats.prefetch_nps(['the senate','oranges','barack obama'],self.log_g,self.log_p,pages,workers=2,timeout=0.5)
+        self.assertLess(time.monotonic() - start,1.5)
+        self.assertEqual((checked,timedOut),(2,1))
+        self.assertNotIn('the senate',self.log_g)
+        self.assertEqual(self.log_p['oranges'],'plural')
+
+    def test_hung_lookup_does_not_block_exit(self):
+        #A source whose lookups never return; the process should still exit as soon as prefetch_nps gives up on them
+        script = ('import threading,npfeats,test_npfeats\n'
+                  'class Hung(test_npfeats.FakePages):\n'
+                  '    def page(self,query):\n'
+                  '        threading.Event().wait()\n'
+                  'print(npfeats.prefetch_nps(["the senate","oranges"],{},{},Hung(),workers=2,timeout=0.5))\n')
+        start = time.monotonic()
+        output = subprocess.run([sys.executable,'-c',script],cwd=SIEVE_DIR,capture_output=True,text=True,timeout=30)
+        self.assertEqual(output.stdout.strip(),'(0, 2)')
+        self.assertLess(time.monotonic() - start,10)
+
+class FakeMediaWiki(BaseHTTPRequestHandler):
+    """Just enough of the MediaWiki API for the wikipedia package to search for PAGES and get their summaries.
+    Every request takes the server's delay seconds."""
+
+    def log_message(self,*args):
+        pass
+
+    def do_GET(self):
+        time.sleep(self.server.delay)
+        params = {key:values[0] for key,values in parse_qs(urlparse(self.path).query,keep_blank_values=True).items()}
+        pages = {page.title.lower():page for page in PAGES}
+        if params.get('list') == 'search':
+            query = params['srsearch'].lower()
+            result = {'query':{'search':[{'title':page.title} for key,page in pages.items() if query in key]}}
+        else:
+            page = pages.get(params.get('titles','').lower())
+            if page is None:
+                result = {'query':{'pages':{'-1':{'missing':''}}}}
+            else:
+                pageId = str(PAGES.index(page) + 1)
+                result = {'query':{'pages':{pageId:{'title':page.title,'pageid':pageId,'fullurl':'','extract':page.summary}}}}
+        body = json.dumps(result).encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type','application/json')
+        self.end_headers()
+        self.wfile.write(body)
+
+class WikipediaPrefetchTest(LogsTestCase):
+
+    def setUp(self):
+        try:
+            import wikipedia
+        except ImportError:
+            self.skipTest('the wikipedia package is not installed')
+        LogsTestCase.setUp(self)
+
+    def serve(self,delay):
+        server = ThreadingHTTPServer(('127.0.0.1',0),FakeMediaWiki)
+        server.daemon_threads = True
+        server.delay = delay
+        threading.Thread(target=server.serve_forever,daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return 'http://127.0.0.1:' + str(server.server_address[1]) + '/w/api.php'
+
+    def test_prefetch_from_server(self):
+        pages = npfeats.open_pages(self.serve(0),timeout=5)
+        self.assertEqual(npfeats.prefetch_nps(['Barack Obama','oranges'],self.log_g,self.log_p,pages,workers=2),(2,0))
+        self.assertEqual(self.log_g['barack obama'],'male')
+        self.assertEqual(self.log_p['oranges'],'plural')
+
+    def test_requests_time_out(self):
+        #Every request to a stuck server gives up after the timeout, so the lookup fails instead of hanging
+        pages = npfeats.open_pages(self.serve(5),timeout=0.5)
+        start = time.monotonic()
+        with self.assertRaises(LookupError):
+            pages.summary('Senate')
+        self.assertLess(time.monotonic() - start,3)
+
+if __name__ == '__main__':
+    unittest.main()